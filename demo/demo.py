@@ -1,11 +1,22 @@
-import imp
-import os
 from textwrap import dedent
-from bs4 import BeautifulSoup
-from subprocess import Popen
-from os.path import join, expanduser, abspath
-from traits.api import HasTraits, Str, List, Property
+from os.path import join, expanduser, abspath, dirname, exists
+from traits.api import HasTraits, Str, List, Dict, Instance, Property, \
+    cached_property
 from jigna.api import Template, WebApp
+from highlighting import highlight_code
+from registry import discover_examples
+from sources import source_cache
+from supervisor import ProcessSupervisor
+from templates import TemplateCache, extract_html_code, precompute_html_code
+from window import ListWindow
+
+#: On-disk cache of the html code extracted from the examples.
+template_cache = TemplateCache(
+    join(dirname(abspath(__file__)), '.cache', 'templates.json')
+)
+
+#: Supervisor of the processes running the examples.
+process_supervisor = ProcessSupervisor()
 
 #### Domain model ####
 
@@ -34,41 +45,79 @@ class Example(HasTraits):
     #: Code representation
     code = Property(Str, depends_on='filename')
     def _get_code(self):
-        return open(join(self.root, self.filename), 'r').read()
+        return self._source_entry().text
 
-    #: Python side code representation
-    python_code = Str
-    def _python_code_default(self):
-        from_domain_model = self.code.split('#### Domain model ####\n')[1]
-        return from_domain_model.split("\n#### UI layer ####")[0]
+    #: Python side code representation. Unless it is set explicitly, this is
+    #: the domain model section of the example's code.
+    python_code = Property(Str, depends_on='filename')
+    def _get_python_code(self):
+        if self._python_code:
+            return self._python_code
+
+        return self._source_entry().memoize(
+            'python_code', self._split_python_code
+        )
+
+    def _set_python_code(self, python_code):
+        self._python_code = python_code
+
+    #: The Python code as highlighted HTML.
+    python_code_html = Property(Str, depends_on='python_code')
+    def _get_python_code_html(self):
+        return highlight_code(self.python_code, 'python')
 
     #: The command to run the example.
     command = Str
     def _command_default(self):
         return 'python %s' % self.filename
 
-    #: HTML side code representation
-    html_code = Str
-    def _html_code_default(self):
-        # change the directory temporarily to the examples root directory
-        old_curdir = abspath(os.curdir)
-        os.chdir(self.root)
+    #: HTML side code representation. Unless it is set explicitly, this is
+    #: the body of the example's template.
+    html_code = Property(Str, depends_on='filename')
+    def _get_html_code(self):
+        if self._html_code:
+            return self._html_code
 
-        # load the template from the example
-        example = imp.load_source(self.ID, self.filename)
-        soup = BeautifulSoup(example.template.html)
+        # Not memoized with the source, the template cache also checks the
+        # HTML files the code was extracted from.
+        return self._load_html_code()
 
-        # change back the current directory
-        os.chdir(old_curdir)
+    def _set_html_code(self, html_code):
+        self._html_code = html_code
 
-        return "".join([str(x) for x in soup.body.prettify()])
+    #: The HTML code as highlighted HTML.
+    html_code_html = Property(Str, depends_on='html_code')
+    def _get_html_code_html(self):
+        return highlight_code(self.html_code, 'html')
 
     def run(self):
         """
         Run the example
         """
         cmd = self.command.split()
-        Popen(cmd, cwd=self.root)
+        process_supervisor.popen(self.ID, cmd, cwd=self.root)
+
+    #### Private protocol #####################################################
+
+    _python_code = Str
+
+    _html_code = Str
+
+    def _source_entry(self):
+        return source_cache.get(join(self.root, self.filename))
+
+    def _split_python_code(self):
+        from_domain_model = self.code.split('#### Domain model ####\n')[1]
+        return from_domain_model.split("\n#### UI layer ####")[0]
+
+    def _load_html_code(self):
+        filename = join(self.root, self.filename)
+        html_code = template_cache.get(filename)
+        if html_code is None:
+            html_code, dependencies = extract_html_code(filename, self.root)
+            template_cache.put(filename, html_code, dependencies)
+
+        return html_code
 
 class ExamplesServer(HasTraits):
     """
@@ -78,8 +127,33 @@ class ExamplesServer(HasTraits):
 
     root = Str
 
+    #: Supervisor of the processes running the examples.
+    supervisor = Instance(ProcessSupervisor)
+    def _supervisor_default(self):
+        return process_supervisor
+
+    #: All the examples: the overrides in their given order, followed by the
+    #: other examples discovered in the examples root.
     examples = List(Example)
     def _examples_default(self):
+        examples = list(self.overrides)
+
+        overridden = set(example.ID for example in examples)
+        for ID, root in discover_examples(self.root):
+            if ID not in overridden:
+                examples.append(Example(root=root, ID=ID))
+
+        return examples
+
+    #: The window of the examples shown in the listing.
+    examples_window = Instance(ListWindow)
+    def _examples_window_default(self):
+        return ListWindow(source=self, name='examples')
+
+    #: Examples with hand-written code snippets, which take the place of the
+    #: discovered examples with the same ID.
+    overrides = List(Example)
+    def _overrides_default(self):
 
         examples = [
             Example(
@@ -334,6 +408,39 @@ class ExamplesServer(HasTraits):
                 """)
             ),
 
+            Example(
+                root='examples',
+                ID='employee_table',
+                python_code=dedent("""
+                    class EmployeeTable(HasTraits):
+                        names = Array(dtype=object)
+                        salaries = Array(dtype=np.int64)
+
+                        #: Fired with the indices of the rows that changed.
+                        salaries_changed = Event
+
+                        def update_salary(self, selection=None):
+                            indices = self._indices(selection)
+                            self.salaries[indices] += ...
+                            self.salaries_changed = indices
+
+                        def row(self, index):
+                            # A proxy, only made for the rows on display.
+                            return EmployeeRow(table=self, index=index)
+                """),
+                html_code=dedent("""
+                    {{employees.count}} employees
+
+                    <button ng-click='employees.update_salary()'>
+                        Update all salaries
+                    </button>
+
+                    <div ng-repeat='employee in employees.page'>
+                        {{employee.name}}: ${{employee.salary}}
+                    </div>
+                """)
+            ),
+
             Example(
                 root='examples/app_manager/',
                 ID='app_manager',
@@ -461,15 +568,29 @@ class ExamplesServer(HasTraits):
 
         return examples
 
+    def precompute_html_code(self):
+        """ Extract the html code of all the examples in parallel, reusing
+        what is in the on-disk cache.
+        """
+        template_cache.load()
+        precompute_html_code(template_cache, [
+            (join(example.root, example.filename), example.root)
+            for example in self.examples
+            if not example._html_code
+            and exists(join(example.root, example.filename))
+        ])
+
     def get_example(self, ID):
         ''' Return the example with the given ID.'''
 
-        example = None
-        for example in self.examples:
-            if example.ID == ID:
-                return example
+        return self._examples_index.get(ID)
+
+    #### Private protocol #####################################################
 
-        return None
+    _examples_index = Property(Dict, depends_on='examples[]')
+    @cached_property
+    def _get__examples_index(self):
+        return dict((example.ID, example) for example in self.examples)
 
 #### UI layer ####
 
@@ -479,6 +600,7 @@ template = Template(html_file='demo.html', recommended_size=(1400, 800))
 
 if __name__ == '__main__':
     examples_server = ExamplesServer(root=expanduser('~/work/jigna/examples'))
+    examples_server.precompute_html_code()
 
     app = WebApp(template=template, context={'server': examples_server}, port=8001)
     app.start()
@@ -2,12 +2,42 @@
 import time
 import os
 import sys
-import math
 import shutil
-from os.path import join, getsize, dirname, exists, isfile, basename
-from traits.api import HasTraits, Str, Bool, Int, List, Instance, Dict, Property
+import threading
+import weakref
+from os.path import join, dirname, exists, isfile, basename, getsize
+from traits.api import HasTraits, Str, Bool, Int, Float, List, Instance, Dict, Property, Any
 from jigna.api import Template, QtApp, WebApp
 
+from cache import BundleCache, hash_file
+from catalog import CatalogEntry, StoreCatalog
+from delta import DeltaException, plan_delta, apply_delta
+from engine import ActionEngine
+from launcher import Launcher
+from metrics import HistogramSink, JSONLTraceSink, Metrics, \
+    PrometheusFileSink, Span, clock
+from reaper import Reaper
+from supervisor import ProcessSupervisor, apply_limits, output_pipes
+from scheduler import ActionCancelledException, InstallScheduler
+from state import StateStore
+from stores import Store, StoreException, open_store
+from transfer import PART_SUFFIX, commit_part_file
+from verify import VerificationException, Verifier, new_digest
+from window import ListWindow
+
+#: Name of the directory in LOCAL_URL that removed apps are moved into.
+TRASH_DIRNAME = '.trash'
+
+#: Name of the database in LOCAL_URL with the state of the installed apps.
+STATE_FILENAME = '.state.db'
+
+#: Upgrades which would have to fetch more than this fraction of a file as a
+#: delta fetch the whole file instead.
+MAX_DELTA_FRACTION = 0.5
+
+#: Suffix of the patched files staged during a delta upgrade.
+DELTA_SUFFIX = '.delta'
+
 #### Exceptions ####
 
 class AppNotInstalledException(Exception):
@@ -27,6 +57,16 @@ class App(HasTraits):
 
     status = Str('none')
 
+    #: The version which is installed, if it is known.
+    installed_version = Str
+
+    #: Size of the installed files in bytes.
+    size = Int
+
+    upgradable = Property(Bool, depends_on='status, version, installed_version')
+    def _get_upgradable(self):
+        return self.status == 'installed' and self.version != self.installed_version
+
     url = Property(Str, depends_on='id')
     def _get_url(self):
         return join(self.id, 'main.py')
@@ -41,69 +81,518 @@ class AppAction(HasTraits):
 
     local_url = Str
 
-    progress = Int
+    #: The phase the action is recorded as in the metrics.
+    phase = Str
+
+    #: Percentage of the work done. This and the other progress traits are
+    #: updated at most 'max_update_rate' times a second.
+    progress = Float
+
+    #: Units of work done and in total (bytes for fetches).
+    work_done = Int
+    work_total = Int
+
+    #: Number of bytes transferred from the store.
+    bytes_transferred = Int
+
+    #: Estimated number of seconds remaining, or -1 if not known yet.
+    eta = Float(-1)
+
+    #: Maximum number of progress notifications per second.
+    max_update_rate = Float(20)
+
+    cancelled = Bool(False)
 
     def execute(self):
         raise NotImplementedError
 
+    def execute_async(self, engine):
+        """ A coroutine which performs the action on the given ActionEngine.
+
+        By default 'execute' is run in the engine's executor.
+        """
+        yield engine.run_in_executor(self.execute)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report_progress(self, done, total):
+        """ Record that 'done' out of 'total' units of work are done.
+
+        The progress traits are only updated if the last update was long
+        enough ago, except for the final update which is always published.
+        """
+        now = time.time()
+        if self._started_at is None:
+            self._started_at = now
+
+        self._done, self._total = done, total
+        if done < total and now - self._published_at < 1.0/self.max_update_rate:
+            return
+
+        self._publish_progress(now)
+
+    #### Private protocol ####
+
+    _started_at = Any
+    _published_at = Float
+    _done = Int
+    _total = Int
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise ActionCancelledException(self.app.id)
+
+    def _threadsafe_progress(self, engine):
+        """ Return a report_progress for another thread than the engine's. """
+        return lambda *args: engine.call_soon_threadsafe(
+            self.report_progress, *args
+        )
+
+    def _publish_progress(self, now):
+        done, total = self._done, self._total
+        if total and done < total:
+            progress = 100.0 * done / total
+            elapsed = now - self._started_at
+            eta = elapsed * (total - done) / done if done and elapsed else -1
+
+        else:
+            progress, eta = 100.0, 0
+
+        self._published_at = now
+        self.trait_set(
+            work_done=done, work_total=total, eta=eta, progress=progress
+        )
+
 class FetchAction(AppAction):
 
+    phase = 'fetch'
+
+    #: The store to fetch the app from.
+    store = Instance(Store)
+    def _store_default(self):
+        return open_store(self.store_url)
+
+    #: Cache of fetched bundles, if any.
+    cache = Instance(BundleCache)
+
+    #: The state store which journals how far the fetch of a bundle got, if
+    #: any. A fetch which was interrupted resumes from there.
+    state = Instance(StateStore)
+
     def execute(self):
         self.app.status = 'fetching'
-        app_filename = join(self.store_url, self.app.url)
+        self._fetch(self.report_progress)
+        self.app.status = 'fetched'
+
+    def execute_async(self, engine):
+        self.app.status = 'fetching'
+        yield engine.run_in_executor(
+            self._fetch, self._threadsafe_progress(engine)
+        )
+        self.app.status = 'fetched'
+
+    def _fetch(self, report_progress):
+        local_dir = join(self.local_url, self.app.id)
+        stat = lambda path: self.store.stat(self.app.id + '/' + path)
+
+        manifest = None
+        if self.cache is not None:
+            manifest = self.cache.get(self.app.id, self.app.version)
+
+        if manifest is not None and self.cache.is_current(manifest, stat) \
+                and self.cache.link(manifest, local_dir):
+            # Fast path: the files were linked from the cache.
+            report_progress(1, 1)
+
+        else:
+            def callback(bytes_done, bytes_total):
+                self._check_cancelled()
+                report_progress(bytes_done, bytes_total)
+
+            checksums = self.store.checksums(self.app.id)
+            verifier = Verifier(checksums) if checksums is not None else None
+
+            offset, checkpoint = self._bundle_checkpoint(checksums)
+            fetched = self.store.fetch_bundle(
+                self.app.id, local_dir, callback=callback, verifier=verifier,
+                offset=offset, checkpoint=checkpoint
+            )
+            if fetched is not None and offset:
+                # The files extracted before the fetch was interrupted.
+                verifier.hash_remaining(local_dir)
+
+            if fetched is None:
+                fetched = self._fetch_files(
+                    local_dir, checksums, verifier, callback
+                )
+
+            self.bytes_transferred = fetched
+            digests = None
+            if verifier is not None:
+                digests = self._verify(verifier, local_dir)
+
+            if self.cache is not None:
+                self.cache.put(
+                    self.app.id, self.app.version, local_dir, stat, digests
+                )
+
+    def _fetch_files(self, local_dir, checksums, verifier, callback):
+        """ Fetch every file of the app one by one, for stores which do not
+        provide bundles, and return the number of bytes fetched.
+        """
+        if checksums and checksums.get('files'):
+            paths = sorted(checksums['files'])
+
+        else:
+            paths = self.store.list_files(self.app.id)
+
+        total = 0
+        for path in paths:
+            stat = self.store.stat(self.app.id + '/' + path)
+            if stat is None:
+                raise StoreException(
+                    '%s/%s not found in %s' % (self.app.id, path, self.store.url)
+                )
+
+            total += stat[0]
+
+        done = 0
+        for path in paths:
+            def report(bytes_done, bytes_total, offset=done):
+                callback(offset + bytes_done, total)
+
+            digest = None
+            if verifier is not None:
+                digest = verifier.hasher(path)
+
+            done += self.store.fetch(
+                self.app.id + '/' + path, join(local_dir, *path.split('/')),
+                callback=report, digest=digest
+            )
+
+        return done
+
+    def _bundle_checkpoint(self, checksums):
+        """ Return the offset to resume the fetch of the bundle from and the
+        function recording how far it got, or (0, None). Fetches are only
+        resumed if the files extracted earlier can be verified and the bundle
+        is known to be the same one.
+        """
+        if self.state is None or not checksums or not checksums.get('files') \
+                or 'bundle' not in checksums:
+            return 0, None
 
-        filesize = getsize(app_filename)
-        chunk_size = int(math.ceil(filesize/10.0))
+        bundle = checksums['bundle']
+        pending = self.state.pending_action(self.app.id)
+        offset = 0
+        if pending is not None and pending[3] is not None \
+                and pending[3].get('bundle') == bundle:
+            offset = pending[3]['offset']
+
+        def checkpoint(offset):
+            self.state.set_action_checkpoint(
+                self.app.id, {'bundle': bundle, 'offset': offset}
+            )
+
+        return offset, checkpoint
+
+    def _verify(self, verifier, local_dir):
+        """ Return the verified digests of the fetched files, or remove the
+        files which do not match and raise a VerificationException.
+        """
+        try:
+            return verifier.wait()
+
+        except VerificationException as e:
+            for path in e.paths:
+                if path is not None:
+                    filename = join(local_dir, *path.split('/'))
+                    if exists(filename):
+                        os.remove(filename)
+
+            raise
+
+class UpgradeAction(FetchAction):
+    """ Upgrades an installed app to the version in the store, fetching only
+    the blocks which changed if the store provides delta signatures.
+    """
+
+    phase = 'upgrade'
+
+    def execute(self):
+        self.app.status = 'upgrading'
+        try:
+            self._fetch(self.report_progress)
+
+        except Exception as e:
+            self._upgrade_failed(e)
+            raise
+
+        self._upgraded()
+
+    def execute_async(self, engine):
+        self.app.status = 'upgrading'
+        try:
+            yield engine.run_in_executor(
+                self._fetch, self._threadsafe_progress(engine)
+            )
+
+        except Exception as e:
+            self._upgrade_failed(e)
+            raise
+
+        self._upgraded()
+
+    def _upgraded(self):
+        self.app.installed_version = self.app.version
+        self.app.status = 'installed'
+
+    def _upgrade_failed(self, error):
+        # The installed version is left in place when an upgrade fails, unless
+        # files which failed verification had replaced it already.
+        if isinstance(error, VerificationException):
+            self.app.status = 'error'
+
+        else:
+            self.app.status = 'installed'
+
+    def _fetch(self, report_progress):
+        try:
+            upgraded = self._fetch_delta(report_progress)
+
+        except (DeltaException, StoreException, EnvironmentError) as e:
+            print 'Delta upgrade of', self.app.id, 'failed:', e
+            upgraded = False
+
+        if not upgraded:
+            super(UpgradeAction, self)._fetch(report_progress)
+
+    def _fetch_delta(self, report_progress):
+        """ Patch the installed files which changed with the blocks which
+        changed and return whether that was possible and worthwhile.
+
+        Every file the store lists for the app is checked, so that none is
+        left at the installed version, and the patched files only replace the
+        installed ones once all of them have been verified.
+        """
+        local_dir = join(self.local_url, self.app.id)
+        stat = lambda path: self.store.stat(self.app.id + '/' + path)
+        if self.cache is not None:
+            # Linking a cached copy of the new version is cheaper still.
+            manifest = self.cache.get(self.app.id, self.app.version)
+            if manifest is not None and self.cache.is_current(manifest, stat):
+                return False
+
+        checksums = self.store.checksums(self.app.id)
+        if not checksums or not checksums.get('files'):
+            # Without the list of files, changes to any but the patched ones
+            # would go unnoticed.
+            return False
+
+        # Plan the files which changed, and fetch those which are new whole.
+        plans = []
+        size = missing = 0
+        for path, expected in sorted(checksums['files'].items()):
+            filename = join(local_dir, *path.split('/'))
+            if not exists(filename):
+                source = stat(path)
+                if source is None:
+                    return False
+
+                plans.append((path, filename, expected, source[0], None))
+                size += source[0]
+                missing += source[0]
+                continue
+
+            if hash_file(filename) == expected:
+                continue
+
+            signature = self.store.signature(self.app.id + '/' + path)
+            if signature is None or signature['sha1'] != expected:
+                return False
+
+            plan = plan_delta(filename, signature)
+            plans.append((path, filename, expected, signature['size'], plan))
+            size += signature['size']
+            missing += plan.missing_bytes
+
+        if missing > MAX_DELTA_FRACTION * size:
+            return False
+
+        # The patched files are staged next to the installed ones, which are
+        # replaced rather than written to, so the objects they may be linked
+        # to in the bundle cache stay intact.
+        staged = []
+        done = fetched = 0
+        try:
+            for path, filename, expected, file_size, plan in plans:
+                def callback(bytes_done, bytes_total, offset=done):
+                    self._check_cancelled()
+                    report_progress(offset + bytes_done, size)
+
+                store_path = self.app.id + '/' + path
+                staged.append(filename + DELTA_SUFFIX)
+                if plan is None:
+                    digest = new_digest()
+                    count = self.store.fetch(
+                        store_path, staged[-1], callback=callback, digest=digest
+                    )
+                    if digest.hexdigest() != expected:
+                        raise DeltaException(
+                            '%s does not match its checksum' % path
+                        )
 
-        with open(app_filename, 'r') as fr:
-            while True:
-                data = fr.read(chunk_size)
-                if not data:
-                    break
                 else:
-                    local_filename = join(self.local_url, self.app.url)
-                    if not exists(dirname(local_filename)):
-                        os.makedirs(dirname(local_filename))
-                    with open(local_filename, 'a') as fw:
-                        fw.write(data)
-                    time.sleep(0.3)
-                    self.progress += int(float(chunk_size) / filesize * 100)
-                    print "written", getsize(local_filename), "bytes"
-        self.app.status = 'fetched'
+                    read_range = lambda start, end, store_path=store_path: \
+                        self.store.read_range(store_path, start, end)
+                    count = apply_delta(
+                        filename, plan, read_range, staged[-1],
+                        callback=callback
+                    )
+
+                fetched += count
+                done += file_size
+
+        except:
+            for filename in staged:
+                for filename in (filename, filename + PART_SUFFIX):
+                    if exists(filename):
+                        os.remove(filename)
+
+            raise
+
+        for filename in staged:
+            commit_part_file(filename, filename[:-len(DELTA_SUFFIX)])
+
+        self.bytes_transferred = fetched
+        if self.cache is not None:
+            # Every file of the app has been verified against its checksum.
+            self.cache.put(
+                self.app.id, self.app.version, local_dir, stat,
+                dict(checksums['files'])
+            )
+
+        return True
 
 class InstallAction(AppAction):
 
+    phase = 'install'
+
+    #: Simulated duration of each of the 10 install steps, in seconds.
+    step_delay = Float(0.3)
+
+    #: The state store which journals the steps, if any. An install which
+    #: was interrupted resumes after the last step it finished.
+    state = Instance(StateStore)
+
     def execute(self):
         self.app.status = 'installing'
-        self.progress = 0
 
-        while self.progress < 100:
-            time.sleep(0.3)
-            self.progress += 10
+        for step in range(self._first_step(), 11):
+            self._check_cancelled()
+            time.sleep(self.step_delay)
+            self._step_done(step)
         self.app.status = 'installed'
 
+    def execute_async(self, engine):
+        self.app.status = 'installing'
+
+        for step in range(self._first_step(), 11):
+            self._check_cancelled()
+            yield engine.sleep(self.step_delay)
+            self._step_done(step)
+        self.app.status = 'installed'
+
+    def _first_step(self):
+        pending = None
+        if self.state is not None:
+            pending = self.state.pending_action(self.app.id)
+
+        if pending is not None and pending[0] == self.phase:
+            return pending[2] + 1
+
+        return 1
+
+    def _step_done(self, step):
+        if self.state is not None:
+            self.state.set_action_step(self.app.id, step)
+
+        self.report_progress(step, 10)
+
 class RemoveAction(AppAction):
 
+    phase = 'remove'
+
+    #: Background remover of trashed app directories, if any.
+    reaper = Instance(Reaper)
+
     def execute(self):
         self.app.status = 'removing'
-        self.progress = 0
+        self._remove(self.report_progress, self._removed)
+
+    def execute_async(self, engine):
+        self.app.status = 'removing'
+        yield engine.run_in_executor(
+            self._remove, self._threadsafe_progress(engine),
+            lambda: engine.call_soon_threadsafe(self._removed)
+        )
 
-        while self.progress < 100:
-            time.sleep(0.3)
-            self.progress += 10
+    def _remove(self, report_progress, removed):
+        app_dir = join(self.local_url, self.app.id)
 
-        shutil.rmtree(join(self.local_url, self.app.id))
-        self.app.status = 'none'
+        if self.reaper is not None:
+            # The action is over once the app directory is in the trash, but
+            # the app shows as being removed until its files are deleted.
+            self.reaper.trash(app_dir, callback=report_progress, done=removed)
+
+        else:
+            shutil.rmtree(app_dir)
+            report_progress(1, 1)
+            removed()
+
+    def _removed(self):
+        # The app may have been installed again in the meantime.
+        if self.app.status == 'removing':
+            self.app.status = 'none'
 
 class StartAction(AppAction):
 
+    phase = 'start'
+
+    #: Launch service with warm interpreters, if any.
+    launcher = Instance(Launcher)
+
+    #: Supervisor of the started apps, if any.
+    supervisor = Instance(ProcessSupervisor)
+
     def execute(self):
         print 'Starting app', self.app.name
-        import subprocess
-        cmd = ['python', basename(self.app.url)]
+        script = basename(self.app.url)
         cwd = join(self.local_url, dirname(self.app.url))
 
-        subprocess.Popen(cmd, cwd=cwd)
+        if self.supervisor is None:
+            self._start(script, cwd, None)
+
+        else:
+            self.supervisor.spawn(
+                self.app.id, lambda limits: self._start(script, cwd, limits)
+            )
+
+    def _start(self, script, cwd, limits):
+        if self.launcher is not None:
+            return self.launcher.launch(self.app.id, script, cwd, limits)
+
+        import subprocess
+        preexec_fn = None
+        if limits and os.name != 'nt':
+            preexec_fn = lambda: apply_limits(limits)
+
+        # The supervisor reads the output of the processes it supervises.
+        pipes = output_pipes() if self.supervisor is not None else {}
+        return subprocess.Popen(
+            ['python', script], cwd=cwd, preexec_fn=preexec_fn, **pipes
+        )
 
 #### App Manager ####
 
@@ -111,91 +600,531 @@ class AppManager(HasTraits):
 
     connected = Bool(False)
 
+    #: The path of a store directory or the URL of a store server.
     STORE_URL = Str
 
+    store = Instance(Store)
+    def _store_default(self):
+        return open_store(self.STORE_URL)
+
     LOCAL_URL = Str
 
-    available_apps = List(App)
+    #: Directory in which the app manager keeps its own bookkeeping.
+    CACHE_URL = Str('cache')
+
+    #: Simulated latencies, in seconds, of connecting to the store and of each
+    #: install step.
+    connect_delay = Float(4)
+    install_step_delay = Float(0.3)
+
+    #: The CatalogEntry objects of the apps in the store. These are promoted
+    #: to App objects by 'get_app' when they are shown or acted on.
+    available_entries = List(CatalogEntry)
 
     installed_apps = List(App)
     def _installed_apps_default(self):
-        installed_apps = []
-        for f in os.listdir(self.LOCAL_URL):
-            if not isfile(f):
-                app = App(id=f, name=self._prettify(f), author='Enthought', status='installed')
-                installed_apps.append(app)
+        if self.state.is_new:
+            self._import_installed_apps()
+
+        return [
+            App(
+                id=record['id'], name=record['name'], author=record['author'],
+                version=record['version'], installed_version=record['version'],
+                size=record['size'], status='installed'
+            )
+            for record in self.state.installed_apps()
+        ]
+
+    #: The installed apps and the journal of the actions in progress.
+    state = Instance(StateStore)
+    def _state_default(self):
+        return StateStore(join(self.LOCAL_URL, STATE_FILENAME))
+
+    #: The windows of the app lists shown in the views.
+    available_window = Instance(ListWindow)
+    def _available_window_default(self):
+        return ListWindow(
+            source=self, name='available_entries', limit=48,
+            adapter=lambda entry: self.get_app(entry.id)
+        )
 
-        return installed_apps
+    installed_window = Instance(ListWindow)
+    def _installed_window_default(self):
+        return ListWindow(source=self, name='installed_apps', limit=48)
 
     actions = Dict(Str, AppAction)
 
+    #: The engine to run actions on as coroutines. Without one, actions run
+    #: in the calling thread and installs in the scheduler's worker threads.
+    engine = Instance(ActionEngine)
+
+    scheduler = Instance(InstallScheduler)
+    def _scheduler_default(self):
+        return InstallScheduler(engine=self.engine)
+
+    launcher = Instance(Launcher)
+    def _launcher_default(self):
+        # The supervisor reads the output of the launched apps.
+        return Launcher(capture_output=True)
+
+    supervisor = Instance(ProcessSupervisor, ())
+
+    reaper = Instance(Reaper)
+    def _reaper_default(self):
+        return Reaper(trash_url=join(self.LOCAL_URL, TRASH_DIRNAME))
+
+    cache = Instance(BundleCache)
+    def _cache_default(self):
+        return BundleCache(join(self.CACHE_URL, 'bundles'))
+
+    #: Timings of the phases of all actions.
+    metrics = Instance(Metrics)
+    def _metrics_default(self):
+        return Metrics(sinks=[HistogramSink()])
+
+    catalog = Instance(StoreCatalog)
+    def _catalog_default(self):
+        catalog = StoreCatalog(
+            store=self.store,
+            manifest_filename=join(self.CACHE_URL, 'catalog.json'),
+            default_author='Enthought'
+        )
+        catalog.load()
+
+        return catalog
+
+    def __init__(self, **traits):
+        super(AppManager, self).__init__(**traits)
+        self._lock = threading.RLock()
+        self._promoted_apps = weakref.WeakValueDictionary()
+
+        # Lists populated by their default methods do not fire change
+        # notifications, so build the indexes explicitly once.
+        self._available_index = self._index_apps(self.available_entries)
+        self._installed_index = self._index_apps(self.installed_apps)
+
+    def get_app(self, id):
+        """ Return the available or installed app with the given id or None.
+
+        Apps which are only available are created from their catalog entry on
+        first use and shared for as long as anything refers to them.
+        """
+        with self._lock:
+            app = self._installed_index.get(id)
+            if app is None:
+                app = self._promoted_apps.get(id)
+
+            if app is None:
+                entry = self._available_index.get(id)
+                if entry is not None:
+                    app = App(id=id, name=self._prettify(id))
+                    self._update_app(app, entry)
+                    self._promoted_apps[id] = app
+
+        return app
+
     def connect(self):
+        """ Connect to the store, or refresh the available apps if connected
+        already. With an engine this returns immediately.
+
+        The methods called from the view return nothing, as a Future cannot
+        be sent to it. Their 'spawn_' counterparts return the Future.
+        """
+        self.spawn_connect()
+
+    def spawn_connect(self):
+        """ Like 'connect', but with an engine return the Future of the
+        connection.
+        """
+        if self.engine is not None:
+            return self.engine.spawn(self._connect_async())
+
         if self.connected:
-            print "Connected already"
+            print "Connected already, refreshing"
+            self._update_available_apps(self.catalog.refresh())
             return
 
         print "Trying to connect to the remote store..."
-        time.sleep(4)
-        if exists(self.STORE_URL):
-            self.connected = True
-            for f in os.listdir(self.STORE_URL):
-                if not isfile(f):
-                    app = self._get_app_with_id(f, self.installed_apps)
-                    if not app:
-                        app = App(id=f, name=self._prettify(f), author='Enthought')
-                    self.available_apps.append(app)
-            print "Connected"
+        time.sleep(self.connect_delay)
+        if self.store.is_available():
+            self.catalog.refresh()
+            self._connected()
 
         else:
             print "Failed"
 
     def install_app(self, app):
+        """ Queue the app for installation and return immediately. An install
+        which was interrupted after its fetch resumes with its install stage.
+        An app which is scheduled already is left as it is.
+        """
+        if app.id in self.scheduler.jobs:
+            return
+
+        app.status = 'queued'
+        queued_at = clock()
+
+        pending = self.state.pending_action(app.id)
+        fetched = pending is not None and pending[:2] == ('install', app.version)
+        if not fetched:
+            self.state.begin_action(app.id, 'fetch', app.version)
+
         # fetch
-        self._perform_action(FetchAction(
-            app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL
-        ))
+        def fetch():
+            self.metrics.record(Span('queue_wait', app.id, start=queued_at))
+            return self._perform_action(FetchAction(
+                app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL,
+                store=self.store, cache=self.cache, state=self.state
+            ))
 
         # install
-        self._perform_action(InstallAction(
-            app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL
-        ))
+        def install():
+            self.state.begin_action(app.id, 'install', app.version)
+            return self._perform_action(InstallAction(
+                app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL,
+                step_delay=self.install_step_delay, state=self.state
+            ))
+
+        def on_done(job, error):
+            self._install_done(app, error)
 
-        self.installed_apps.append(app)
+        self.scheduler.submit(
+            app.id, None if fetched else fetch, install, on_done
+        )
+
+    def cancel_app(self, app):
+        """ Cancel a queued or running install of the app. """
+        self.scheduler.cancel(app.id)
+        with self._lock:
+            action = self.actions.get(app.id)
+
+        if action is not None:
+            action.cancel()
 
     def remove_app(self, app):
-        self._perform_action(RemoveAction(
-            app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL
-        ))
+        self.spawn_remove_app(app)
+
+    def spawn_remove_app(self, app):
+        """ Like 'remove_app', but with an engine return the Future of the
+        removal.
+        """
+        action = RemoveAction(
+            app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL,
+            reaper=self.reaper
+        )
+        self.state.begin_action(app.id, 'remove')
+        if self.engine is not None:
+            return self.engine.spawn(self._finish_action_async(action))
 
-        self.installed_apps.remove(app)
+        self._finish_action(action)
+
+    def upgrade_app(self, app):
+        """ Upgrade the installed app to the version in the store. """
+        self.spawn_upgrade_app(app)
+
+    def spawn_upgrade_app(self, app):
+        """ Like 'upgrade_app', but with an engine return the Future of the
+        upgrade.
+        """
+        action = UpgradeAction(
+            app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL,
+            store=self.store, cache=self.cache, state=self.state
+        )
+        self.state.begin_action(app.id, 'upgrade', app.version)
+        if self.engine is not None:
+            return self.engine.spawn(self._finish_action_async(action))
+
+        self._finish_action(action)
+
+    def resume_actions(self):
+        """ Resume the actions which were in progress when the app manager
+        last stopped, eg. because it crashed.
+        """
+        for id, phase, version in self.state.pending_actions():
+            app = self._installed_index.get(id)
+            if phase in ('fetch', 'install'):
+                self.install_app(app or self._resumed_app(id, version))
+
+            elif phase == 'upgrade' and app is not None:
+                app.version = version
+                self.upgrade_app(app)
+
+            elif phase == 'remove' and app is not None:
+                if exists(join(self.LOCAL_URL, id)):
+                    self.remove_app(app)
+
+                else:
+                    self._app_removed(app)
+
+            else:
+                self.state.end_action(id)
 
     def start_app(self, app):
-        self._perform_action(StartAction(
-            app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL
-        ))
+        self.spawn_start_app(app)
+
+    def spawn_start_app(self, app):
+        """ Like 'start_app', but with an engine return the Future of the
+        start.
+        """
+        action = StartAction(
+            app=app, store_url=self.STORE_URL, local_url=self.LOCAL_URL,
+            launcher=self.launcher, supervisor=self.supervisor
+        )
+        if self.engine is not None:
+            return self.engine.spawn(self._perform_action(action))
+
+        self._perform_action(action)
 
     #### Private protocol #####################################################
 
+    _lock = Any
+
+    #: Apps created from catalog entries, by id, for as long as they are used.
+    _promoted_apps = Any
+
     def _perform_action(self, action):
-        self.actions[action.app.id] = action
-        action.execute()
+        """ Perform the action, or with an engine return a coroutine which
+        performs it.
+        """
+        with self._lock:
+            self.actions[action.app.id] = action
+
+        if self.scheduler.is_cancelled(action.app.id):
+            action.cancel()
+
+        if self.engine is not None:
+            return self._perform_action_async(action)
+
+        with self.metrics.span(action.phase, action.app.id) as span:
+            action.execute()
+            span.bytes = action.bytes_transferred
+
+    def _perform_action_async(self, action):
+        with self.metrics.span(action.phase, action.app.id) as span:
+            yield self.engine.spawn(action.execute_async(self.engine))
+            span.bytes = action.bytes_transferred
+
+    def _connect_async(self):
+        if self.connected:
+            print "Connected already, refreshing"
+
+        else:
+            print "Trying to connect to the remote store..."
+            yield self.engine.sleep(self.connect_delay)
+            available = yield self.engine.run_in_executor(
+                self.store.is_available
+            )
+            if not available:
+                print "Failed"
+                return
+
+        # Listing the store is blocking I/O.
+        changes = yield self.engine.run_in_executor(self.catalog.refresh)
+        if self.connected:
+            self._update_available_apps(changes)
+
+        else:
+            self._connected()
+
+    def _connected(self):
+        self.connected = True
+        self.available_entries = list(self.catalog.entries.values())
+        for app in self.installed_apps:
+            entry = self._available_index.get(app.id)
+            if entry is not None:
+                self._update_app(app, entry)
+
+        print "Connected"
+
+    def _finish_action(self, action):
+        """ Perform a remove or upgrade action and record its outcome. """
+        try:
+            self._perform_action(action)
+
+        except Exception:
+            self.state.end_action(action.app.id)
+            raise
+
+        self._action_done(action)
+
+    def _finish_action_async(self, action):
+        try:
+            yield self.engine.spawn(self._perform_action(action))
+
+        except Exception:
+            self.state.end_action(action.app.id)
+            raise
+
+        self._action_done(action)
+
+    def _action_done(self, action):
+        if isinstance(action, RemoveAction):
+            self._app_removed(action.app)
+
+        else:
+            self._save_installed(action.app)
+
+    def _app_removed(self, app):
+        with self._lock:
+            self.installed_apps.remove(app)
+            self._promoted_apps[app.id] = app
+
+        self.state.set_removed(app.id)
+
+    def _install_done(self, app, error):
+        if error is None:
+            app.installed_version = app.version
+            self._save_installed(app)
+            with self._lock:
+                if app.id not in self._installed_index:
+                    self.installed_apps.append(app)
+
+        elif isinstance(error, ActionCancelledException):
+            self.state.end_action(app.id)
+            app.status = 'none'
+
+        else:
+            self.state.end_action(app.id)
+            app.status = 'error'
+
+    def _save_installed(self, app):
+        app.size = _directory_size(join(self.LOCAL_URL, app.id))
+        self.state.set_installed([{
+            'id': app.id, 'name': app.name, 'version': app.installed_version,
+            'author': app.author, 'size': app.size
+        }])
+
+    def _import_installed_apps(self):
+        """ Record the apps installed before there was a state database. """
+        records = []
+        for f in os.listdir(self.LOCAL_URL):
+            path = join(self.LOCAL_URL, f)
+            if f.startswith('.') or isfile(path):
+                continue
+
+            records.append({
+                'id': f, 'name': self._prettify(f), 'version': '',
+                'author': 'Enthought', 'size': _directory_size(path)
+            })
+
+        self.state.set_installed(records)
+
+    def _resumed_app(self, id, version):
+        """ Return an app for an install which is resumed before connecting
+        to the store, going by the saved catalog for its author.
+        """
+        app = App(id=id, name=self._prettify(id), version=version)
+        entry = self.catalog.entries.get(id)
+        if entry is not None:
+            app.author = entry.author
+
+        with self._lock:
+            self._promoted_apps[id] = app
+
+        return app
+
+    def _update_available_apps(self, changes):
+        """ Update the available apps with the changes in the store catalog.
+        """
+        if not changes:
+            return
+
+        # The entries are replaced and deleted by index, so that the UI only
+        # redraws those which changed and they all keep their place.
+        entries = self.available_entries
+        positions = dict((entry.id, i) for i, entry in enumerate(entries))
+        added = list(changes.added)
+        for entry in changes.changed:
+            if entry.id in positions:
+                entries[positions[entry.id]] = entry
+
+            else:
+                added.append(entry)
+
+        for index in sorted(
+            (positions[id] for id in changes.removed if id in positions),
+            reverse=True
+        ):
+            del entries[index]
+
+        if added:
+            entries.extend(added)
+
+        # Bring the apps which exist already up to date.
+        for entry in changes.changed:
+            with self._lock:
+                app = self._installed_index.get(entry.id)
+                if app is None:
+                    app = self._promoted_apps.get(entry.id)
+
+            if app is not None:
+                self._update_app(app, entry)
+
+    def _update_app(self, app, entry):
+        app.version = entry.version
+        app.author = entry.author
 
     def _prettify(self, str):
         str = str.replace("_", " ")
         return str.capitalize()
 
-    def _get_app_with_id(self, id, apps):
-        """ Returns the app with the given id among the supplied list of apps
-        or None.
-        """
-        for app in apps:
-            if app.id == id:
-                return app
+    #### Id indexes ####
+
+    #: Available entries and installed apps keyed by their id. These are kept
+    #: in sync with the lists by the trait change handlers below.
+    _available_index = Dict(Str, CatalogEntry)
+    _installed_index = Dict(Str, App)
+
+    def _available_entries_changed(self, new):
+        self._available_index = self._index_apps(new)
+
+    def _available_entries_items_changed(self, event):
+        self._update_index(self._available_index, event)
+
+    def _installed_apps_changed(self, new):
+        self._installed_index = self._index_apps(new)
 
-        return None
+    def _installed_apps_items_changed(self, event):
+        self._update_index(self._installed_index, event)
+
+    def _index_apps(self, apps):
+        return dict((app.id, app) for app in apps)
+
+    def _update_index(self, index, event):
+        for app in event.removed:
+            if index.get(app.id) is app:
+                del index[app.id]
+
+        for app in event.added:
+            index[app.id] = app
+
+def _directory_size(directory):
+    return sum(
+        getsize(join(root, filename))
+        for root, dirs, filenames in os.walk(directory)
+        for filename in filenames
+    )
 
 def main():
-    app_manager = AppManager(STORE_URL='store', LOCAL_URL='local')
+    # With an engine every action method returns immediately, so the view
+    # calls them directly instead of in a thread each.
+    app_manager = AppManager(
+        STORE_URL=os.environ.get('APP_MANAGER_STORE', 'store'),
+        LOCAL_URL='local', CACHE_URL='cache',
+        engine=ActionEngine()
+    )
+    if not exists(app_manager.CACHE_URL):
+        os.makedirs(app_manager.CACHE_URL)
+
+    app_manager.metrics.sinks.extend([
+        PrometheusFileSink(
+            filename=join(app_manager.CACHE_URL, 'metrics.prom')
+        ),
+        JSONLTraceSink(filename=join(app_manager.CACHE_URL, 'trace.jsonl'))
+    ])
+    app_manager.launcher.start()
+    app_manager.reaper.start()
+    app_manager.resume_actions()
     template = Template(
         html_file=join('gui', 'app_manager.html'),
         base_url='gui',
@@ -0,0 +1,204 @@
+""" Benchmarks for the app manager.
+
+Generates a synthetic store of apps with log-normally distributed sizes and
+measures connecting to it, fetching, installing, removing and starting apps
+with all simulated latencies turned off. The results are printed (or written
+to a file) as JSON so that runs on different commits can be compared.
+
+Usage: python benchmark.py [--apps N] [--mean-size BYTES] [--big-size BYTES]
+                           [--seed SEED] [--output FILENAME]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+from app_manager import App, AppManager, FetchAction
+
+
+def make_store(store_url, n_apps, mean_size, seed):
+    """ Create a store with 'n_apps' apps whose sizes are log-normally
+    distributed around 'mean_size' bytes, and return the sizes.
+    """
+    rng = random.Random(seed)
+    sigma = 1.0
+    mu = math.log(mean_size) - sigma ** 2 / 2
+
+    sizes = []
+    for i in range(n_apps):
+        size = max(16, int(rng.lognormvariate(mu, sigma)))
+        make_app(join(store_url, 'app_%06d' % i), size)
+        sizes.append(size)
+
+    return sizes
+
+
+def make_app(app_dir, size):
+    """ Create an app with a 'main.py' of the given size which does nothing.
+    """
+    os.makedirs(app_dir)
+    line = b'#' * 79 + b'\n'
+    with open(join(app_dir, 'main.py'), 'wb') as f:
+        f.write(b'pass\n')
+        remaining = size - 5
+        f.write(line * (remaining // len(line)))
+        f.write(b'#' * (remaining % len(line)))
+
+
+def run(n_apps, mean_size, big_size, seed):
+    """ Run all the benchmarks and return the results as a dict. """
+    workdir = tempfile.mkdtemp(prefix='app_manager_benchmark')
+    try:
+        return _run(workdir, n_apps, mean_size, big_size, seed)
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app manager.')
+    parser.add_argument('--apps', type=int, default=200)
+    parser.add_argument('--mean-size', type=int, default=64 * 1024)
+    parser.add_argument('--big-size', type=int, default=256 * 1024 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    # Keep the app manager's own messages out of the JSON on stdout.
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        results = run(args.apps, args.mean_size, args.big_size, args.seed)
+
+    finally:
+        sys.stdout = stdout
+
+    report = {
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'params': {
+            'apps': args.apps,
+            'mean_size': args.mean_size,
+            'big_size': args.big_size,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    else:
+        print(text)
+
+
+#### Private protocol #########################################################
+
+def _run(workdir, n_apps, mean_size, big_size, seed):
+    results = {}
+
+    store_url = join(workdir, 'store')
+    sizes = make_store(store_url, n_apps, mean_size, seed)
+
+    # Connect.
+    manager = _make_manager(workdir)
+    results['connect_cold_s'] = _time(manager.connect)
+    results['connect_refresh_s'] = _time(manager.connect)
+    results['connect_warm_s'] = _time(_make_manager(workdir).connect)
+
+    # Fetch a single big app.
+    big_store_url = join(workdir, 'big_store')
+    make_app(join(big_store_url, 'big'), big_size)
+    fetch = FetchAction(
+        app=App(id='big'), store_url=big_store_url,
+        local_url=join(workdir, 'big_local')
+    )
+    elapsed = _time(fetch.execute)
+    results['fetch_s'] = elapsed
+    results['fetch_mb_per_s'] = big_size / elapsed / 1e6
+
+    # Install every app in the store.
+    started = time.time()
+    for entry in list(manager.available_entries):
+        manager.install_app(manager.get_app(entry.id))
+
+    _wait_until(lambda: not manager.scheduler.jobs)
+    elapsed = time.time() - started
+    results['install_all_s'] = elapsed
+    results['install_apps_per_s'] = n_apps / elapsed
+    results['install_mb_per_s'] = sum(sizes) / elapsed / 1e6
+
+    # Start a few apps, once the launcher's workers have warmed up.
+    manager.launcher.start()
+    time.sleep(1)
+    apps = list(manager.installed_apps)[:5]
+    for app in apps:
+        manager.start_app(app)
+
+    latencies = [p.spawn_latency for p in manager.supervisor.processes]
+    _wait_until(lambda: not manager.supervisor.processes)
+    if latencies:
+        results['start_spawn_latency_s'] = sum(latencies) / len(latencies)
+
+    # Remove every installed app.
+    started = time.time()
+    for app in list(manager.installed_apps):
+        manager.remove_app(app)
+
+    results['remove_all_s'] = time.time() - started
+    _wait_until(lambda: not manager.reaper.pending)
+    results['remove_all_reaped_s'] = time.time() - started
+
+    return results
+
+
+def _make_manager(workdir):
+    local_url = join(workdir, 'local')
+    if not os.path.isdir(local_url):
+        os.makedirs(local_url)
+
+    return AppManager(
+        STORE_URL=join(workdir, 'store'), LOCAL_URL=local_url,
+        CACHE_URL=join(workdir, 'cache'), connect_delay=0,
+        install_step_delay=0
+    )
+
+
+def _time(function):
+    started = time.time()
+    function()
+    return time.time() - started
+
+
+def _wait_until(predicate, timeout=600, interval=0.01):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise RuntimeError('Timed out waiting for the benchmark')
+
+        time.sleep(interval)
+
+
+def _git_commit():
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=dirname(abspath(__file__))
+        )
+        return output.decode('ascii').strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+""" Packed app bundles.
+
+A bundle holds all the files of an app in a single file, each compressed with
+deflate:
+
+    MAGIC
+    for every file: ENTRY header, its path, its compressed contents
+    an ENTRY header with an empty path, marking the end of the files
+    the index as JSON, mapping every path to where its contents are
+    TRAILER with the offset of the index, MAGIC
+
+Every file is preceded by its own header, so a bundle can be extracted while
+it is still arriving (see BundleExtractor), and the index at the end lets
+BundleReader read single files through a memory map without unpacking the rest.
+
+Usage: python bundle.py pack DIRECTORY BUNDLE
+       python bundle.py list BUNDLE
+       python bundle.py extract BUNDLE PATH DESTINATION
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from os.path import dirname, exists, join, relpath
+
+from transfer import PART_SUFFIX, commit_part_file
+
+#: Marks the start and the end of a bundle.
+MAGIC = 'APPBNDL1'
+
+#: Path length, CRC-32, compressed size and size of a file.
+ENTRY = struct.Struct('>HIQQ')
+
+#: Offset of the index.
+TRAILER = struct.Struct('>Q')
+
+#: Default compression level.
+DEFAULT_LEVEL = 6
+
+#: Size of the blocks files are compressed and decompressed in.
+BLOCK_SIZE = 256 * 1024
+
+#: Deflate streams are raw, the entry headers carry the checksums.
+_WBITS = -zlib.MAX_WBITS
+
+
+class BundleException(Exception):
+    pass
+
+
+def pack(directory, filename, level=DEFAULT_LEVEL):
+    """ Pack the files in 'directory' into a bundle and return its index. """
+    index = {}
+    part_filename = filename + PART_SUFFIX
+    if dirname(filename) and not exists(dirname(filename)):
+        os.makedirs(dirname(filename))
+
+    with open(part_filename, 'wb') as f:
+        f.write(MAGIC)
+        for root, dirs, filenames in os.walk(directory):
+            dirs.sort()
+            for name in sorted(filenames):
+                src = join(root, name)
+                path = relpath(src, directory).replace(os.sep, '/')
+                index[path] = _pack_file(src, path, f, level)
+
+        f.write(ENTRY.pack(0, 0, 0, 0))
+        index_offset = f.tell()
+        f.write(json.dumps(index, sort_keys=True))
+        f.write(TRAILER.pack(index_offset) + MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+
+    commit_part_file(part_filename, filename)
+    return index
+
+
+class BundleExtractor(object):
+    """ Extracts a bundle into a directory from its bytes as they arrive.
+
+        extractor = BundleExtractor(directory)
+        for data in chunks:
+            extractor.feed(data)
+        extractor.close()
+
+    Every file is written to a '.part' file first and moved into place once
+    its checksum has been verified, so files which were there already are
+    replaced rather than written to. Call 'abort' if the bundle is not going
+    to be fed to the end. A 'verify.Verifier', if given, is handed the
+    contents of every file as it is written.
+
+    'checkpoint', if given, is called as checkpoint(offset) once every file
+    is in place, with the offset in the bundle that an interrupted extraction
+    can be resumed from by feeding the bundle from there to an extractor
+    created with that 'offset'.
+    """
+
+    def __init__(self, directory, verifier=None, offset=0, checkpoint=None):
+        self.directory = directory
+        self.verifier = verifier
+        self.checkpoint = checkpoint
+
+        #: The paths of the files extracted so far.
+        self.paths = []
+
+        #: The offset in the bundle up to which it has been parsed.
+        self.offset = offset
+
+        self._pending = ''
+        self._state = 'header' if offset else 'magic'
+        self._header = None
+        self._path = None
+        self._remaining = 0
+        self._file = None
+        self._hasher = None
+        self._decompressor = None
+        self._crc = 0
+        self._size = 0
+
+    def feed(self, data):
+        data = self._pending + data
+        offset = 0
+        while offset < len(data):
+            if self._state == 'data':
+                chunk = data[offset:offset + self._remaining]
+                offset += len(chunk)
+                self.offset += len(chunk)
+                self._remaining -= len(chunk)
+                self._decompress(chunk)
+                if not self._remaining:
+                    self._finish_file()
+
+                continue
+
+            if self._state == 'tail':
+                # The index is only needed for random access.
+                self.offset += len(data) - offset
+                offset = len(data)
+                break
+
+            needed = self._needed()
+            if len(data) - offset < needed:
+                break
+
+            offset += needed
+            self.offset += needed
+            self._parse(data[offset - needed:offset])
+
+        self._pending = data[offset:]
+
+    def close(self):
+        """ Check that the whole bundle was extracted. """
+        if self._state != 'tail':
+            self.abort()
+            raise BundleException('The bundle ended early')
+
+    def abort(self):
+        """ Remove the file being extracted, if any. """
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._file.name)
+            self._file = None
+
+    #### Private protocol #####################################################
+
+    def _needed(self):
+        if self._state == 'magic':
+            return len(MAGIC)
+
+        if self._state == 'header':
+            return ENTRY.size
+
+        return self._header[0]
+
+    def _parse(self, data):
+        if self._state == 'magic':
+            if data != MAGIC:
+                raise BundleException('Not a bundle')
+
+            self._state = 'header'
+
+        elif self._state == 'header':
+            self._header = ENTRY.unpack(data)
+            self._state = 'path' if self._header[0] else 'tail'
+
+        else:
+            self._start_file(_check_path(data.decode('utf-8')))
+
+    def _start_file(self, path):
+        self._path = path
+        filename = join(self.directory, *path.split('/'))
+        if not exists(dirname(filename)):
+            os.makedirs(dirname(filename))
+
+        self._file = open(filename + PART_SUFFIX, 'wb')
+        if self.verifier is not None:
+            self._hasher = self.verifier.hasher(path)
+
+        self._decompressor = zlib.decompressobj(_WBITS)
+        self._crc = 0
+        self._size = 0
+        self._remaining = self._header[2]
+        self._state = 'data'
+        if not self._remaining:
+            self._finish_file()
+
+    def _decompress(self, chunk):
+        # Limit the output, highly compressed data could take a lot of memory.
+        try:
+            while chunk:
+                self._write(self._decompressor.decompress(chunk, BLOCK_SIZE))
+                chunk = self._decompressor.unconsumed_tail
+
+        except zlib.error as e:
+            self.abort()
+            raise BundleException('%s is corrupt: %s' % (self._path, e))
+
+    def _write(self, data):
+        self._file.write(data)
+        if self._hasher is not None:
+            self._hasher.update(data)
+
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+
+    def _finish_file(self):
+        self._write(self._decompressor.flush())
+        crc, size = self._header[1], self._header[3]
+        if self._crc & 0xffffffff != crc or self._size != size:
+            self.abort()
+            raise BundleException('%s is corrupt' % self._path)
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        commit_part_file(self._file.name, self._file.name[:-len(PART_SUFFIX)])
+
+        self._file = None
+        self.paths.append(self._path)
+        self._state = 'header'
+        if self.checkpoint is not None:
+            self.checkpoint(self.offset)
+
+
+class BundleReader(object):
+    """ Reads single files from a bundle through a memory map.
+
+        with BundleReader(filename) as bundle:
+            data = bundle.read('main.py')
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            except ValueError:
+                raise BundleException('%s is empty' % filename)
+
+        try:
+            self.index = self._read_index()
+
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._data.close()
+
+    def read(self, path):
+        """ Return the contents of the file. """
+        return ''.join(self._iter_blocks(path))
+
+    def extract(self, path, dst):
+        """ Write the file to 'dst'. """
+        if dirname(dst) and not exists(dirname(dst)):
+            os.makedirs(dirname(dst))
+
+        part_filename = dst + PART_SUFFIX
+        with open(part_filename, 'wb') as f:
+            for data in self._iter_blocks(path):
+                f.write(data)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        commit_part_file(part_filename, dst)
+
+    #### Private protocol #####################################################
+
+    def _read_index(self):
+        data = self._data
+        trailer_size = TRAILER.size + len(MAGIC)
+        if len(data) < len(MAGIC) + trailer_size \
+                or data[:len(MAGIC)] != MAGIC or data[-len(MAGIC):] != MAGIC:
+            raise BundleException('Not a bundle')
+
+        index_offset, = TRAILER.unpack(
+            data[-trailer_size:-len(MAGIC)]
+        )
+        return json.loads(data[index_offset:-trailer_size])
+
+    def _iter_blocks(self, path):
+        """ Decompress the file in blocks, straight from the map. """
+        info = self.index.get(path)
+        if info is None:
+            raise BundleException('%s is not in the bundle' % path)
+
+        decompressor = zlib.decompressobj(_WBITS)
+        crc = 0
+        start = info['offset']
+        end = start + info['compressed_size']
+        while start < end:
+            chunk = self._data[start:min(start + BLOCK_SIZE, end)]
+            start += len(chunk)
+            while chunk:
+                data = decompressor.decompress(chunk, BLOCK_SIZE)
+                crc = zlib.crc32(data, crc)
+                yield data
+                chunk = decompressor.unconsumed_tail
+
+        data = decompressor.flush()
+        crc = zlib.crc32(data, crc)
+        yield data
+
+        if crc & 0xffffffff != info['crc32']:
+            raise BundleException('%s is corrupt' % path)
+
+
+def _pack_file(src, path, f, level):
+    """ Write an entry for the file and return its index entry. """
+    encoded = path.encode('utf-8')
+    header_offset = f.tell()
+    f.write(ENTRY.pack(len(encoded), 0, 0, 0))
+    f.write(encoded)
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS)
+    crc = size = 0
+    offset = f.tell()
+    with open(src, 'rb') as fr:
+        while True:
+            data = fr.read(BLOCK_SIZE)
+            if not data:
+                break
+
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            f.write(compressor.compress(data))
+
+    f.write(compressor.flush())
+    end = f.tell()
+    crc &= 0xffffffff
+
+    # Fill in the header now that the sizes are known.
+    f.seek(header_offset)
+    f.write(ENTRY.pack(len(encoded), crc, end - offset, size))
+    f.seek(end)
+
+    return {
+        'offset': offset, 'compressed_size': end - offset, 'size': size,
+        'crc32': crc
+    }
+
+
+def _check_path(path):
+    """ Return the path if it stays inside the directory extracted into. """
+    parts = path.split('/')
+    if path.startswith('/') or '\\' in path or '..' in parts or '' in parts:
+        raise BundleException('Invalid path in bundle: %r' % path)
+
+    return path
+
+
+def main():
+    if len(sys.argv) < 3:
+        print __doc__
+        return
+
+    command = sys.argv[1]
+    if command == 'pack':
+        index = pack(sys.argv[2], sys.argv[3])
+        print 'Packed', len(index), 'files into', sys.argv[3]
+
+    elif command == 'list':
+        with BundleReader(sys.argv[2]) as bundle:
+            for path, info in sorted(bundle.index.items()):
+                print '%10d %10d %s' % (
+                    info['size'], info['compressed_size'], path
+                )
+
+    elif command == 'extract':
+        with BundleReader(sys.argv[2]) as bundle:
+            bundle.extract(sys.argv[3], sys.argv[4])
+
+    else:
+        print __doc__
+
+if __name__ == '__main__':
+    main()
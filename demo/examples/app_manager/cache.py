@@ -0,0 +1,318 @@
+""" A content-addressed cache of fetched app bundles.
+
+Every file of a fetched bundle is stored once under the hash of its contents,
+so identical files are shared between apps and between versions of an app.
+The files of an installed app are reflinks to the cached objects where the
+file system supports them and hard links otherwise, which makes reinstalling
+a cached bundle a matter of creating links instead of fetching it again. As
+an app may write to its files, and so to the objects they are hard links to,
+objects are checked against their hash before they are linked again. Objects
+are evicted least recently used first once the cache grows beyond its size
+budget, together with the manifests of the bundles they belong to.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from os.path import dirname, exists, getsize, join, relpath
+
+#: Default size budget of the cache in bytes.
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+#: Size of the blocks in which files are hashed.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+#: The Linux ioctl request that clones (reflinks) a file.
+FICLONE = 0x40049409
+
+
+class BundleCache(object):
+    """ A content-addressed cache of app bundles with LRU eviction. """
+
+    def __init__(self, root, max_size=DEFAULT_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+
+        #: [last use, size] of every object by digest and the total size of
+        #: the objects, read from the disk when they are first needed.
+        self._objects = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, app_id, version):
+        """ Return the manifest of the cached bundle for the given app version
+        or None if it is not (completely) cached.
+
+        A manifest maps the path of every file relative to the app directory
+        to a dict with its 'hash', 'size' and the 'mtime' of its source.
+        """
+        manifest_filename = self._manifest_filename(app_id, version)
+        if not exists(manifest_filename):
+            return None
+
+        with open(manifest_filename, 'r') as f:
+            manifest = json.load(f)
+
+        for info in manifest.values():
+            if not exists(self._object_filename(info['hash'])):
+                return None
+
+        return manifest
+
+    def is_current(self, manifest, stat):
+        """ Return whether the manifest matches the source files, going by
+        their sizes and modification times.
+
+        'stat' is called as stat(path) with the path of a file in the manifest
+        and returns the (size, mtime) of its source or None, like Store.stat.
+        """
+        for path, info in manifest.items():
+            source = stat(path)
+            if source is None or source != (info['size'], info['mtime']):
+                return False
+
+        return True
+
+    def put(self, app_id, version, directory, stat, digests=None):
+        """ Add the files in 'directory' to the cache as the bundle for the
+        given app version and return its manifest.
+
+        The files in 'directory' are replaced by links to the cached objects.
+        'stat' returns the (size, mtime) of their sources as for 'is_current'.
+        'digests' may map paths to the hex digests of files which are known
+        already, to save hashing them again.
+        """
+        manifest = {}
+        for root, dirs, filenames in os.walk(directory):
+            for filename in filenames:
+                filename = join(root, filename)
+                path = relpath(filename, directory).replace(os.sep, '/')
+                source = stat(path)
+
+                digest = digests.get(path) if digests else None
+                if digest is None:
+                    digest = hash_file(filename)
+
+                self._store(filename, digest)
+                manifest[path] = {
+                    'hash': digest,
+                    'size': getsize(filename),
+                    'mtime': source[1] if source is not None else None
+                }
+
+        manifest_filename = self._manifest_filename(app_id, version)
+        _makedirs(dirname(manifest_filename))
+        with open(manifest_filename, 'w') as f:
+            json.dump(manifest, f)
+
+        self.evict()
+        return manifest
+
+    def link(self, manifest, directory):
+        """ Create the files of a cached bundle in 'directory' and return
+        True, or return False without creating any if an object of the
+        bundle no longer matches its hash. Such objects are removed.
+        """
+        damaged = [
+            info['hash'] for info in manifest.values()
+            if not _matches(self._object_filename(info['hash']), info['hash'])
+        ]
+        if damaged:
+            self._remove_objects(damaged)
+            return False
+
+        for path, info in manifest.items():
+            obj = self._object_filename(info['hash'])
+            filename = join(directory, *path.split('/'))
+            _makedirs(dirname(filename))
+            if exists(filename):
+                os.remove(filename)
+
+            _link_or_clone(obj, filename)
+            self._touch(info['hash'])
+
+        return True
+
+    def evict(self):
+        """ Remove least recently used objects until the cache fits its size
+        budget.
+        """
+        with self._lock:
+            objects = self._load_objects()
+            if self._size <= self.max_size:
+                return
+
+            evicted = []
+            for used, size, digest in sorted(
+                (used, size, digest)
+                for digest, (used, size) in objects.items()
+            ):
+                if self._size <= self.max_size:
+                    break
+
+                evicted.append(digest)
+                self._size -= size
+                del objects[digest]
+
+        self._remove_objects(evicted)
+
+    #### Private protocol #####################################################
+
+    def _manifest_filename(self, app_id, version):
+        return join(self.root, 'bundles', app_id, (version or '_') + '.json')
+
+    def _object_filename(self, digest):
+        return join(self.root, 'objects', digest[:2], digest)
+
+    def _store(self, filename, digest):
+        """ Store the file under its digest unless an identical object is
+        already cached, and make the file a link to the object.
+        """
+        obj = self._object_filename(digest)
+        if not exists(obj):
+            _makedirs(dirname(obj))
+            _link_or_clone(filename, obj)
+
+        elif not _same_file(obj, filename):
+            if hash_file(obj) == digest:
+                os.remove(filename)
+                _link_or_clone(obj, filename)
+
+            else:
+                # The object was written to through a link, the file replaces
+                # it.
+                os.remove(obj)
+                _link_or_clone(filename, obj)
+
+        self._touch(digest)
+
+    def _touch(self, digest):
+        """ Record that the object was just used. """
+        obj = self._object_filename(digest)
+        os.utime(obj, None)
+        size = getsize(obj)
+        with self._lock:
+            objects = self._load_objects()
+            if digest in objects:
+                self._size -= objects[digest][1]
+
+            objects[digest] = [time.time(), size]
+            self._size += size
+
+    def _load_objects(self):
+        """ Return the objects by digest, reading them from the disk the
+        first time. The lock must be held.
+        """
+        if self._objects is None:
+            self._objects = {}
+            self._size = 0
+            for root, dirs, filenames in os.walk(join(self.root, 'objects')):
+                for filename in filenames:
+                    stat = os.stat(join(root, filename))
+                    self._objects[filename] = [stat.st_mtime, stat.st_size]
+                    self._size += stat.st_size
+
+        return self._objects
+
+    def _remove_objects(self, digests):
+        """ Remove the objects and the manifests of the bundles which refer to
+        them.
+        """
+        digests = set(digests)
+        if not digests:
+            return
+
+        with self._lock:
+            objects = self._load_objects()
+            for digest in digests:
+                if digest in objects:
+                    self._size -= objects.pop(digest)[1]
+
+        for digest in digests:
+            _ignore_missing(os.remove, self._object_filename(digest))
+
+        for root, dirs, filenames in os.walk(join(self.root, 'bundles')):
+            for filename in filenames:
+                manifest_filename = join(root, filename)
+                try:
+                    with open(manifest_filename, 'r') as f:
+                        manifest = json.load(f)
+
+                except (IOError, ValueError):
+                    continue
+
+                if any(info['hash'] in digests for info in manifest.values()):
+                    _ignore_missing(os.remove, manifest_filename)
+
+
+def hash_file(filename):
+    """ Return the hex digest of the contents of the given file. """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(HASH_BLOCK_SIZE)
+            if not data:
+                break
+
+            sha.update(data)
+
+    return sha.hexdigest()
+
+
+def _link_or_clone(src, dst):
+    """ Reflink 'src' to 'dst', so that writing to either leaves the other
+    intact, falling back to a hard link and then to a plain copy.
+    """
+    try:
+        import fcntl
+        with open(src, 'rb') as fr:
+            with open(dst, 'wb') as fw:
+                fcntl.ioctl(fw.fileno(), FICLONE, fr.fileno())
+        return
+
+    except (ImportError, IOError, OSError):
+        if exists(dst):
+            os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return
+
+    except (OSError, AttributeError):
+        pass
+
+    shutil.copyfile(src, dst)
+
+
+def _matches(filename, digest):
+    return exists(filename) and hash_file(filename) == digest
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+
+    except (AttributeError, OSError):
+        return False
+
+
+def _ignore_missing(function, path):
+    try:
+        function(path)
+
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,164 @@
+""" A persistent, incrementally refreshed index of the apps in a store.
+
+The index is saved as a JSON manifest. Refreshing it only lists the store when
+the store has changed (going by the validator the store returned for the last
+listing, eg. the modification time of a store directory or the ETag of a
+store server), and only reads the metadata of entries whose directory has
+changed since the last refresh. Apps are expected to be published by renaming
+a complete app directory into the store, which updates the modification time
+of the store directory.
+
+Entries are kept as compact CatalogEntry records, so that a large catalog can
+be held in memory without creating a full App object for every entry.
+"""
+
+import json
+import os
+from os.path import dirname, exists
+
+
+class CatalogEntry(object):
+    """ The metadata of an app in the store. """
+
+    __slots__ = ('id', 'version', 'author', 'size', 'mtime')
+
+    def __init__(self, id, version='', author='', size=0, mtime=None):
+        self.id = id
+        self.version = version
+        self.author = author
+        self.size = size
+        self.mtime = mtime
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class CatalogChanges(object):
+    """ The differences found by a catalog refresh. """
+
+    def __init__(self, added=None, changed=None, removed=None):
+        #: Entries for apps that are new in the store.
+        self.added = added or []
+
+        #: Entries for apps whose store directory has changed.
+        self.changed = changed or []
+
+        #: Ids of apps which are no longer in the store.
+        self.removed = removed or []
+
+    def __nonzero__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    __bool__ = __nonzero__
+
+
+class StoreCatalog(object):
+    """ A persistent index of the apps available in a store. """
+
+    def __init__(self, store, manifest_filename, default_author=''):
+        #: The Store the catalog indexes.
+        self.store = store
+        self.manifest_filename = manifest_filename
+        self.default_author = default_author
+
+        #: CatalogEntry objects keyed by app id.
+        self.entries = {}
+
+        #: The validator of the store listing at the last refresh.
+        self.store_validator = None
+
+        # Shared copies of the strings which are repeated across entries.
+        self._strings = {}
+
+    def load(self):
+        """ Load the manifest saved by a previous refresh, if any. """
+        if not exists(self.manifest_filename):
+            return
+
+        with open(self.manifest_filename, 'r') as f:
+            manifest = json.load(f)
+
+        if manifest.get('store_url') != self.store.url:
+            return
+
+        self.store_validator = manifest.get('store_validator')
+        self.entries = dict(
+            (data['id'], self._entry_from_dict(data))
+            for data in manifest['entries']
+        )
+
+    def refresh(self):
+        """ Bring the index up to date with the store and return the
+        CatalogChanges found.
+        """
+        store_validator, apps = self.store.listing(self.store_validator)
+        if apps is None:
+            return CatalogChanges()
+
+        changes = CatalogChanges()
+        for id, mtime in apps.items():
+            entry = self.entries.get(id)
+            if entry is not None and entry.mtime == mtime:
+                continue
+
+            entry = self._read_entry(id, mtime)
+            if id in self.entries:
+                changes.changed.append(entry)
+
+            else:
+                changes.added.append(entry)
+
+            self.entries[id] = entry
+
+        for id in set(self.entries) - set(apps):
+            del self.entries[id]
+            changes.removed.append(id)
+
+        self.store_validator = store_validator
+        self.save()
+
+        return changes
+
+    def save(self):
+        """ Atomically write the manifest. """
+        directory = dirname(self.manifest_filename)
+        if directory and not exists(directory):
+            os.makedirs(directory)
+
+        manifest = {
+            'store_url': self.store.url,
+            'store_validator': self.store_validator,
+            'entries': [entry.to_dict() for entry in self.entries.values()]
+        }
+
+        tmp_filename = self.manifest_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(manifest, f)
+
+        if os.name == 'nt' and exists(self.manifest_filename):
+            os.remove(self.manifest_filename)
+
+        os.rename(tmp_filename, self.manifest_filename)
+
+    #### Private protocol #####################################################
+
+    def _share(self, string):
+        return self._strings.setdefault(string, string)
+
+    def _entry_from_dict(self, data):
+        entry = CatalogEntry.from_dict(data)
+        entry.version = self._share(entry.version)
+        entry.author = self._share(entry.author)
+
+        return entry
+
+    def _read_entry(self, id, mtime):
+        data = {'id': id, 'version': '', 'author': self.default_author}
+        data.update(self.store.read_metadata(id))
+        data['mtime'] = mtime
+
+        return self._entry_from_dict(data)
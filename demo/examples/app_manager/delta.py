@@ -0,0 +1,277 @@
+""" Delta transfers of files which changed a little between versions.
+
+The store publishes a signature of the new version of a file: a weak, rolling
+checksum and a strong hash of each of its blocks. The client rolls the weak
+checksum over its copy of the old version to find the blocks it has already,
+possibly at other offsets, and fetches only the byte ranges of the blocks it
+does not have. The new version is assembled in a '.part' file which replaces
+the old version once its hash has been verified.
+"""
+
+import hashlib
+import mmap
+import os
+import zlib
+from os.path import getsize
+
+from transfer import PART_SUFFIX, commit_part_file
+
+#: Bounds of the block size of signatures.
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 128 * 1024
+
+#: Number of blocks the checksum is rolled over without finding a match
+#: before only whole blocks are compared, until one matches again. This keeps
+#: a file which changed completely from being rolled over byte by byte.
+MAX_ROLL_BLOCKS = 2
+
+#: The modulus of the Adler-32 checksum.
+_ADLER_MOD = 65521
+
+
+class DeltaException(Exception):
+    pass
+
+
+def block_size_for(size):
+    """ Return the block size for a signature of a file of the given size,
+    a power of two close to its square root.
+    """
+    block_size = MIN_BLOCK_SIZE
+    while block_size * block_size < size and block_size < MAX_BLOCK_SIZE:
+        block_size *= 2
+
+    return block_size
+
+
+def signature(filename, block_size=None):
+    """ Return the signature of the file as a dict which can be saved as JSON.
+    """
+    size = getsize(filename)
+    if block_size is None:
+        block_size = block_size_for(size)
+
+    blocks = []
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+
+            digest.update(data)
+            blocks.append([weak_checksum(data), _strong_hash(data)])
+
+    return {
+        'size': size, 'block_size': block_size, 'blocks': blocks,
+        'sha1': digest.hexdigest()
+    }
+
+
+def weak_checksum(data):
+    return zlib.adler32(data) & 0xffffffff
+
+
+class DeltaPlan(object):
+    """ Where to get every block of the new version of a file from. """
+
+    def __init__(self, signature, sources):
+        self.signature = signature
+
+        #: For every block of the new version, the offset of the same block in
+        #: the old version, or None if it has to be fetched.
+        self.sources = sources
+
+    @property
+    def missing_ranges(self):
+        """ The [start, end) byte ranges of the new version to fetch, with
+        adjacent missing blocks merged.
+        """
+        block_size = self.signature['block_size']
+        size = self.signature['size']
+
+        ranges = []
+        for index, source in enumerate(self.sources):
+            if source is not None:
+                continue
+
+            start = index * block_size
+            end = min(start + block_size, size)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+
+            else:
+                ranges.append([start, end])
+
+        return ranges
+
+    @property
+    def missing_bytes(self):
+        return sum(end - start for start, end in self.missing_ranges)
+
+
+def plan_delta(old_filename, signature):
+    """ Return the DeltaPlan to build the new version of a file with the given
+    signature from the old version.
+    """
+    blocks = signature['blocks']
+    sources = [None] * len(blocks)
+    if not blocks or not getsize(old_filename):
+        return DeltaPlan(signature, sources)
+
+    with open(old_filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            _match_blocks(data, signature, sources)
+
+        finally:
+            data.close()
+
+    return DeltaPlan(signature, sources)
+
+
+def apply_delta(old_filename, plan, read_range, dst, callback=None):
+    """ Write the new version of the file to 'dst' from the old version and
+    the byte ranges missing from it, and return the number of bytes fetched.
+
+    'read_range' is called as read_range(start, end) and returns those bytes
+    of the new version. 'callback', if given, is called as
+    callback(bytes_done, bytes_total) and may raise to abort.
+    """
+    signature = plan.signature
+    block_size = signature['block_size']
+    size = signature['size']
+    part_filename = dst + PART_SUFFIX
+
+    fetched = 0
+    done = 0
+    digest = hashlib.sha1()
+    missing = dict((start, end) for start, end in plan.missing_ranges)
+    with open(old_filename, 'rb') as fr, open(part_filename, 'wb') as fw:
+        index = 0
+        while index < len(plan.sources):
+            start = index * block_size
+            if start in missing:
+                end = missing[start]
+                data = read_range(start, end)
+                if len(data) != end - start:
+                    raise DeltaException('Short read of %d-%d' % (start, end))
+
+                fetched += len(data)
+
+            else:
+                end = min(start + block_size, size)
+                fr.seek(plan.sources[index])
+                data = fr.read(end - start)
+
+            fw.write(data)
+            digest.update(data)
+            done += len(data)
+            index = (end + block_size - 1) // block_size
+            if callback is not None:
+                callback(done, size)
+
+        fw.flush()
+        os.fsync(fw.fileno())
+
+    if digest.hexdigest() != signature['sha1']:
+        os.remove(part_filename)
+        raise DeltaException('The patched file does not match its signature')
+
+    commit_part_file(part_filename, dst)
+    return fetched
+
+
+#### Private protocol #########################################################
+
+def _strong_hash(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def _match_blocks(data, signature, sources):
+    """ Find the blocks of the signature in the data and record their offsets
+    in 'sources'.
+    """
+    block_size = signature['block_size']
+    blocks = signature['blocks']
+
+    by_weak = {}
+    for index, (weak, strong) in enumerate(blocks):
+        by_weak.setdefault(weak, []).append(index)
+
+    # The last block may be short, look for it at the end of the data.
+    last_size = signature['size'] - (len(blocks) - 1) * block_size
+    if last_size < block_size and len(data) >= last_size:
+        if _strong_hash(data[len(data) - last_size:]) == blocks[-1][1]:
+            sources[-1] = len(data) - last_size
+
+    offset = 0
+    window = None
+    misses = 0
+    while offset + block_size <= len(data):
+        if window is None:
+            window = _Rolling(data, offset, block_size)
+
+        index = _find_block(
+            data, offset, block_size, window.checksum, by_weak, blocks, sources
+        )
+        if index is not None:
+            # Jump over the block, there is no need to roll through it.
+            sources[index] = offset
+            offset += block_size
+            window = None
+            misses = 0
+
+        elif misses < MAX_ROLL_BLOCKS * block_size:
+            if offset + block_size == len(data):
+                break
+
+            window.roll()
+            offset += 1
+            misses += 1
+
+        else:
+            offset += block_size
+            window = None
+
+
+def _find_block(data, offset, block_size, weak, by_weak, blocks, sources):
+    """ Return the index of a block which is still missing and matches the
+    data at the offset, or None.
+    """
+    candidates = by_weak.get(weak)
+    if not candidates:
+        return None
+
+    strong = _strong_hash(data[offset:offset + block_size])
+    for index in candidates:
+        if sources[index] is None and blocks[index][1] == strong:
+            return index
+
+    return None
+
+
+class _Rolling(object):
+    """ An Adler-32 checksum of a window of the data that can be moved along
+    one byte at a time.
+    """
+
+    def __init__(self, data, offset, size):
+        self.data = data
+        self.offset = offset
+        self.size = size
+        checksum = zlib.adler32(data[offset:offset + size]) & 0xffffffff
+        self.a = checksum & 0xffff
+        self.b = checksum >> 16
+
+    @property
+    def checksum(self):
+        return (self.b << 16) | self.a
+
+    def roll(self):
+        """ Move the window one byte to the right. """
+        out = ord(self.data[self.offset])
+        new = ord(self.data[self.offset + self.size])
+        self.a = (self.a - out + new) % _ADLER_MOD
+        self.b = (self.b - self.size * out + self.a - 1) % _ADLER_MOD
+        self.offset += 1
@@ -0,0 +1,276 @@
+""" A single threaded engine for running actions as coroutines.
+
+Coroutines are generators which yield Futures and are resumed with their
+results (or have their exceptions raised into them) once they are done:
+
+    def install(engine):
+        yield engine.sleep(0.3)
+        data = yield engine.run_in_executor(read_file, filename)
+
+All coroutines run on the engine's one loop thread, so the trait changes they
+make are never concurrent. Blocking calls run in a small pool of executor
+threads and anything running in another thread hands work back to the loop
+with 'call_soon_threadsafe'. This way hundreds of actions can be in progress
+with only a handful of threads.
+"""
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+import traceback
+from Queue import Queue
+
+from traits.api import HasTraits, Any, Int
+
+
+class Future(object):
+    """ The result of an operation which may not have finished yet. """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the operation and return its result, or raise its
+        exception.
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError('Timed out waiting for the result')
+
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+        return self._result
+
+    def exception(self):
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, callback):
+        """ Call callback(future) once the future is done. The callback is
+        called in whichever thread finishes the future.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """ Finish with the exception given as a sys.exc_info() tuple. """
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback(self)
+
+
+class Semaphore(object):
+    """ Limits the number of coroutines in a section at the same time.
+
+    Only to be used from the loop thread:
+
+        yield semaphore.acquire()
+        try:
+            ...
+        finally:
+            semaphore.release()
+    """
+
+    def __init__(self, value):
+        self._value = value
+        self._waiters = []
+
+    def acquire(self):
+        future = Future()
+        if self._value > 0:
+            self._value -= 1
+            future.set_result(None)
+
+        else:
+            self._waiters.append(future)
+
+        return future
+
+    def release(self):
+        if self._waiters:
+            self._waiters.pop(0).set_result(None)
+
+        else:
+            self._value += 1
+
+
+class ActionEngine(HasTraits):
+    """ Runs coroutines on a single loop thread. """
+
+    #: Number of threads running blocking calls.
+    max_workers = Int(4)
+
+    #: Number of coroutines which have not finished yet.
+    running = Int
+
+    def __init__(self, **traits):
+        super(ActionEngine, self).__init__(**traits)
+        self._condition = threading.Condition()
+        self._ready = []
+        self._timers = []
+        self._counter = itertools.count()
+        self._executor_queue = Queue()
+
+    def start(self):
+        """ Start the loop thread, if it is not running yet. """
+        with self._condition:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._run_executor)
+                worker.daemon = True
+                worker.start()
+
+    def spawn(self, coroutine):
+        """ Run the coroutine on the loop and return a Future for it. This
+        can be called from any thread.
+        """
+        self.start()
+        future = Future()
+        self.call_soon_threadsafe(self._spawn, coroutine, future)
+
+        return future
+
+    def call_soon_threadsafe(self, function, *args):
+        """ Call the function on the loop thread as soon as possible. """
+        with self._condition:
+            self._ready.append((function, args))
+            self._condition.notify()
+
+    def sleep(self, seconds):
+        """ Return a Future which is done after the given number of seconds.
+        """
+        future = Future()
+        with self._condition:
+            heapq.heappush(
+                self._timers, (time.time() + seconds, next(self._counter), future)
+            )
+            self._condition.notify()
+
+        return future
+
+    def run_in_executor(self, function, *args):
+        """ Call the function in an executor thread and return a Future for
+        its result.
+        """
+        self.start()
+        future = Future()
+        self._executor_queue.put((function, args, future))
+
+        return future
+
+    #### Private protocol #####################################################
+
+    _condition = Any
+
+    _thread = Any
+
+    #: (function, args) to call on the loop thread.
+    _ready = Any
+
+    #: A heap of (when, counter, future) of sleeping coroutines.
+    _timers = Any
+
+    _counter = Any
+
+    _executor_queue = Any
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready:
+                    timeout = None
+                    if self._timers:
+                        timeout = self._timers[0][0] - time.time()
+                        if timeout <= 0:
+                            break
+
+                    self._condition.wait(timeout)
+
+                now = time.time()
+                while self._timers and self._timers[0][0] <= now:
+                    future = heapq.heappop(self._timers)[2]
+                    self._ready.append((future.set_result, (None,)))
+
+                ready, self._ready = self._ready, []
+
+            for function, args in ready:
+                try:
+                    function(*args)
+
+                except Exception:
+                    traceback.print_exc()
+
+    def _run_executor(self):
+        while True:
+            function, args, future = self._executor_queue.get()
+            try:
+                result = function(*args)
+
+            except Exception:
+                future.set_exception(sys.exc_info())
+
+            else:
+                future.set_result(result)
+
+    def _spawn(self, coroutine, future):
+        self.running += 1
+        self._step(coroutine, future, None)
+
+    def _step(self, coroutine, future, waited):
+        try:
+            if waited is None:
+                yielded = coroutine.next()
+
+            elif waited._exc_info is not None:
+                yielded = coroutine.throw(*waited._exc_info)
+
+            else:
+                yielded = coroutine.send(waited._result)
+
+        except StopIteration:
+            self.running -= 1
+            future.set_result(None)
+
+        except Exception:
+            self.running -= 1
+            if not future._callbacks:
+                # Nobody is waiting for the coroutine, so report the error.
+                traceback.print_exc()
+
+            future.set_exception(sys.exc_info())
+
+        else:
+            yielded.add_done_callback(
+                lambda done: self.call_soon_threadsafe(
+                    self._step, coroutine, future, done
+                )
+            )
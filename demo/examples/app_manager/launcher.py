@@ -0,0 +1,200 @@
+""" A launch service which starts apps in pre-warmed interpreters.
+
+The launcher keeps a pool of worker interpreters which have already imported
+the heavy modules every app needs. Starting an app hands it to a warm worker,
+which then runs the app's script as '__main__'. Workers report back over a
+pipe when the app has shown its first window, which the launcher records as
+the app's time to first window.
+
+Running this module as a script starts a worker.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from os.path import abspath, splitext
+from subprocess import PIPE, Popen
+
+from traits.api import HasTraits, Any, Bool, Dict, Float, Int, List, Str
+
+from supervisor import apply_limits, output_pipes
+
+#: Modules imported by every worker before it is handed an app.
+PRELOAD_MODULES = ['traits.api', 'jigna.api']
+
+#: One more than the highest file descriptor a worker may inherit.
+try:
+    MAXFD = os.sysconf('SC_OPEN_MAX')
+
+except (AttributeError, ValueError):
+    MAXFD = 256
+
+
+class Worker(object):
+    """ A warm worker interpreter waiting for an app to run. """
+
+    def __init__(self, python, capture_output=False):
+        report_read, report_write = os.pipe()
+
+        # The worker only inherits the write end of the report pipe, which
+        # close_fds would close as well.
+        def close_fds():
+            os.closerange(3, report_write)
+            os.closerange(report_write + 1, MAXFD)
+
+        self.process = Popen(
+            [python, _worker_script(), str(report_write)],
+            stdin=PIPE, preexec_fn=close_fds,
+            **(output_pipes() if capture_output else {})
+        )
+        os.close(report_write)
+        self.reports = os.fdopen(report_read, 'r')
+
+    def run(self, script, cwd, limits=None):
+        """ Hand the app to the worker. """
+        request = {'script': script, 'cwd': cwd, 'limits': limits}
+        request = json.dumps(request) + '\n'
+        self.process.stdin.write(request.encode('utf-8'))
+        self.process.stdin.close()
+
+    def wait_for(self, message):
+        """ Block until the worker reports the message and return whether it
+        did before exiting.
+        """
+        for line in self.reports:
+            if line.strip() == message:
+                return True
+
+        return False
+
+
+class Launcher(HasTraits):
+    """ Starts apps in a pool of pre-warmed worker interpreters. """
+
+    #: The number of warm workers to keep around.
+    pool_size = Int(2)
+
+    #: The Python interpreter used for the workers.
+    python = Str(sys.executable)
+
+    #: Whether the output of the workers is piped. Whoever launches an app
+    #: must then read its output, eg. through a ProcessSupervisor.
+    capture_output = Bool(False)
+
+    #: Seconds from the launch request to the first window, by app id.
+    time_to_window = Dict(Str, Float)
+
+    def __init__(self, **traits):
+        super(Launcher, self).__init__(**traits)
+        self._lock = threading.RLock()
+
+    def start(self):
+        """ Fill the pool of warm workers. """
+        with self._lock:
+            while len(self._pool) < self.pool_size:
+                self._pool.append(Worker(self.python, self.capture_output))
+
+    def launch(self, id, script, cwd, limits=None):
+        """ Run the script of the app with the given id in a warm worker and
+        return the worker process.
+
+        'limits' are resource limits as returned by ProcessSupervisor.limits.
+        """
+        requested = time.time()
+        with self._lock:
+            worker = None
+            while self._pool and worker is None:
+                worker = self._pool.pop(0)
+                if worker.process.poll() is not None:
+                    # The worker died while it was waiting.
+                    worker.reports.close()
+                    worker = None
+
+            if worker is None:
+                worker = Worker(self.python, self.capture_output)
+
+        worker.run(script, cwd, limits)
+
+        thread = threading.Thread(
+            target=self._record_first_window, args=(id, worker, requested)
+        )
+        thread.daemon = True
+        thread.start()
+
+        self.start()
+        return worker.process
+
+    #### Private protocol #####################################################
+
+    _lock = Any
+
+    _pool = List
+
+    def _record_first_window(self, id, worker, requested):
+        if worker.wait_for('window'):
+            self.time_to_window[id] = time.time() - requested
+
+
+#### Worker side ####
+
+def run_worker(report_fd):
+    """ Preload the heavy modules and wait for an app to run. """
+    for module in PRELOAD_MODULES:
+        try:
+            __import__(module)
+
+        except ImportError:
+            pass
+
+    _report_first_window(report_fd)
+
+    line = sys.stdin.readline()
+    if not line:
+        return
+
+    request = json.loads(line)
+    apply_limits(request['limits'])
+    os.chdir(request['cwd'])
+    sys.path.insert(0, abspath(request['cwd']))
+    sys.argv = [request['script']]
+
+    import runpy
+    runpy.run_path(request['script'], run_name='__main__')
+
+
+def _report_first_window(report_fd):
+    """ Report to the launcher once the app's event loop is running, which is
+    when its first window is shown.
+    """
+    def report():
+        os.write(report_fd, b'window\n')
+        os.close(report_fd)
+
+    try:
+        from jigna.api import QtApp
+
+    except ImportError:
+        return
+
+    start = QtApp.start
+    def start_and_report(self, *args, **kw):
+        try:
+            from jigna.qt import QtCore
+            QtCore.QTimer.singleShot(0, report)
+
+        except ImportError:
+            report()
+
+        return start(self, *args, **kw)
+
+    QtApp.start = start_and_report
+
+
+def _worker_script():
+    return splitext(abspath(__file__))[0] + '.py'
+
+
+if __name__ == '__main__':
+    run_worker(int(sys.argv[1]))
@@ -0,0 +1,227 @@
+""" Timing and metrics for the phases of app actions.
+
+Every phase an app goes through (waiting in the queue, fetching, installing,
+removing and starting) is recorded as a Span and handed to the sinks of a
+Metrics object:
+
+ - HistogramSink keeps per phase histograms as traits the UI can bind to,
+ - PrometheusFileSink also writes them to a file in the Prometheus text format,
+ - JSONLTraceSink appends every span to a file as a line of JSON.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from traits.api import HasTraits, Any, Dict, Float, Int, List, Str
+
+from scheduler import ActionCancelledException
+
+#: A monotonic clock, where there is one.
+clock = getattr(time, 'monotonic', time.time)
+
+#: Upper bounds (in seconds) of the histogram buckets.
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+class Span(object):
+    """ A phase of an action on an app. """
+
+    def __init__(self, phase, app_id, start=None):
+        self.phase = phase
+        self.app_id = app_id
+        self.start = clock() if start is None else start
+        self.end = None
+
+        #: Bytes transferred during the phase.
+        self.bytes = 0
+
+        #: One of 'ok', 'error' or 'cancelled'.
+        self.outcome = 'ok'
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {
+            'phase': self.phase, 'app_id': self.app_id, 'start': self.start,
+            'duration': self.duration, 'bytes': self.bytes,
+            'outcome': self.outcome
+        }
+
+
+class Metrics(HasTraits):
+    """ Records spans and hands them to its sinks. """
+
+    #: Objects with a 'record(span)' method.
+    sinks = List
+
+    @contextmanager
+    def span(self, phase, app_id):
+        """ Record the code run in the context as a span, which is yielded so
+        that the code can fill in the bytes it transferred.
+        """
+        span = Span(phase, app_id)
+        try:
+            yield span
+
+        except ActionCancelledException:
+            span.outcome = 'cancelled'
+            raise
+
+        except Exception:
+            span.outcome = 'error'
+            raise
+
+        finally:
+            span.end = clock()
+            self.record(span)
+
+    def record(self, span):
+        if span.end is None:
+            span.end = clock()
+
+        # A failing sink must not fail the action the span belongs to.
+        for sink in self.sinks:
+            try:
+                sink.record(span)
+
+            except Exception as e:
+                print 'Recording the', span.phase, 'span of', span.app_id, \
+                    'failed:', e
+
+
+class PhaseStats(HasTraits):
+    """ Aggregated spans of one phase. """
+
+    count = Int
+
+    total_seconds = Float
+
+    mean_seconds = Float
+
+    bytes = Int
+
+    #: Number of spans per outcome.
+    outcomes = Dict(Str, Int)
+
+    #: Number of spans with a duration up to the matching bound in BUCKETS,
+    #: followed by the number of longer spans.
+    buckets = List(Int)
+    def _buckets_default(self):
+        return [0] * (len(BUCKETS) + 1)
+
+    def add(self, span):
+        duration = span.duration
+        index = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                index = i
+                break
+
+        self.buckets[index] += 1
+        self.outcomes[span.outcome] = self.outcomes.get(span.outcome, 0) + 1
+        self.bytes += span.bytes
+        self.total_seconds += duration
+        self.count += 1
+        self.mean_seconds = self.total_seconds / self.count
+
+
+class HistogramSink(HasTraits):
+    """ Keeps in-memory statistics per phase. """
+
+    #: Statistics keyed by phase.
+    phases = Dict(Str, PhaseStats)
+
+    def __init__(self, **traits):
+        super(HistogramSink, self).__init__(**traits)
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            stats = self.phases.get(span.phase)
+            if stats is None:
+                stats = self.phases[span.phase] = PhaseStats()
+
+            stats.add(span)
+
+    #### Private protocol #####################################################
+
+    _lock = Any
+
+
+class PrometheusFileSink(HistogramSink):
+    """ Writes the statistics to a file in the Prometheus text format, eg.
+    for the node exporter's textfile collector.
+    """
+
+    filename = Str
+
+    #: Prefix of the metric names.
+    prefix = Str('app_manager')
+
+    def record(self, span):
+        super(PrometheusFileSink, self).record(span)
+
+        # Spans are recorded from several threads, which all write the same
+        # temporary file.
+        tmp_filename = self.filename + '.tmp'
+        with self._lock:
+            with open(tmp_filename, 'w') as f:
+                f.write(self.to_text())
+
+            os.rename(tmp_filename, self.filename)
+
+    def to_text(self):
+        name = self.prefix + '_phase_seconds'
+        lines = ['# TYPE %s histogram' % name]
+        for phase, stats in sorted(self.phases.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), stats.buckets):
+                cumulative += count
+                lines.append('%s_bucket{phase="%s",le="%s"} %d' % (
+                    name, phase, bound, cumulative
+                ))
+
+            lines.append('%s_sum{phase="%s"} %f' % (
+                name, phase, stats.total_seconds
+            ))
+            lines.append('%s_count{phase="%s"} %d' % (name, phase, stats.count))
+
+        name = self.prefix + '_phase_bytes_total'
+        lines.append('# TYPE %s counter' % name)
+        for phase, stats in sorted(self.phases.items()):
+            lines.append('%s{phase="%s"} %d' % (name, phase, stats.bytes))
+
+        name = self.prefix + '_phase_outcomes_total'
+        lines.append('# TYPE %s counter' % name)
+        for phase, stats in sorted(self.phases.items()):
+            for outcome, count in sorted(stats.outcomes.items()):
+                lines.append('%s{phase="%s",outcome="%s"} %d' % (
+                    name, phase, outcome, count
+                ))
+
+        return '\n'.join(lines) + '\n'
+
+
+class JSONLTraceSink(HasTraits):
+    """ Appends every span to a file as a line of JSON. """
+
+    filename = Str
+
+    def __init__(self, **traits):
+        super(JSONLTraceSink, self).__init__(**traits)
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        line = json.dumps(span.to_dict()) + '\n'
+        with self._lock:
+            with open(self.filename, 'a') as f:
+                f.write(line)
+
+    #### Private protocol #####################################################
+
+    _lock = Any
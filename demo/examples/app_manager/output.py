@@ -0,0 +1,164 @@
+""" Streaming of the output of child processes.
+
+A single OutputPump thread reads the pipes of all child processes with
+'select', so there is no thread per process. Every process has an OutputBuffer
+which keeps the last lines of its output and publishes new lines in batches,
+at most once every 'flush_interval' seconds. If a process produces lines
+faster than that, only the last 'max_batch' lines of a batch are published,
+so a chatty process cannot flood the views bound to it.
+"""
+
+import collections
+import os
+import select
+import threading
+import time
+
+from traits.api import HasTraits, Any, Dict, Event, Float, Int, List, \
+    Property, Str
+
+#: Whether pipes can be waited on with 'select' on this platform.
+SUPPORTED = os.name != 'nt'
+
+
+class OutputBuffer(HasTraits):
+    """ The recent output of a process. """
+
+    #: Number of lines kept.
+    max_lines = Int(1000)
+
+    #: The last 'max_lines' lines of output.
+    lines = Property(List(Str))
+    def _get_lines(self):
+        with self._lock:
+            return list(self._lines)
+
+    #: Fired with a list of the lines output since the last batch.
+    new_lines = Event
+
+    #: Number of lines that were not published because they came too fast.
+    dropped = Int
+
+    #: Whether the process has closed its output.
+    closed = Event
+
+    def __init__(self, **traits):
+        super(OutputBuffer, self).__init__(**traits)
+        self._lock = threading.Lock()
+        self._lines = collections.deque(maxlen=self.max_lines)
+        self._pending = []
+
+    #### Private protocol #####################################################
+
+    _lock = Any
+
+    _lines = Any
+
+    _pending = Any
+
+    def _append(self, line):
+        with self._lock:
+            self._lines.append(line)
+            self._pending.append(line)
+
+    def _flush(self, max_batch):
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        if not pending:
+            return
+
+        if len(pending) > max_batch:
+            self.dropped += len(pending) - max_batch
+            pending = pending[-max_batch:]
+
+        self.new_lines = pending
+
+
+class OutputPump(HasTraits):
+    """ Reads the output of any number of processes in one thread. """
+
+    #: Minimum number of seconds between two batches of a buffer.
+    flush_interval = Float(0.1)
+
+    #: Maximum number of lines in a batch.
+    max_batch = Int(200)
+
+    def __init__(self, **traits):
+        super(OutputPump, self).__init__(**traits)
+        self._lock = threading.Lock()
+        self._wake_read, self._wake_write = os.pipe()
+
+    def add(self, stream, buffer):
+        """ Read lines from the stream (a pipe) into the buffer until it is
+        closed.
+        """
+        with self._lock:
+            self._streams[stream.fileno()] = (stream, buffer, [b''])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+        os.write(self._wake_write, b'x')
+
+    #### Private protocol #####################################################
+
+    _lock = Any
+
+    _thread = Any
+
+    _wake_read = Int
+
+    _wake_write = Int
+
+    #: (stream, buffer, [partial line]) by file descriptor.
+    _streams = Dict
+
+    def _run(self):
+        last_flush = time.time()
+        while True:
+            with self._lock:
+                fds = list(self._streams)
+
+            timeout = max(0, last_flush + self.flush_interval - time.time())
+            readable = select.select(fds + [self._wake_read], [], [], timeout)[0]
+            for fd in readable:
+                if fd == self._wake_read:
+                    os.read(self._wake_read, 4096)
+
+                else:
+                    self._read(fd)
+
+            if time.time() - last_flush >= self.flush_interval:
+                with self._lock:
+                    buffers = [buffer for _, buffer, _ in self._streams.values()]
+
+                for buffer in buffers:
+                    buffer._flush(self.max_batch)
+
+                last_flush = time.time()
+
+    def _read(self, fd):
+        stream, buffer, partial = self._streams[fd]
+        data = os.read(fd, 65536)
+        if not data:
+            if partial[0]:
+                buffer._append(_decode(partial[0]))
+
+            buffer._flush(self.max_batch)
+            buffer.closed = True
+            stream.close()
+            with self._lock:
+                del self._streams[fd]
+
+            return
+
+        lines = (partial[0] + data).split(b'\n')
+        partial[0] = lines.pop()
+        for line in lines:
+            buffer._append(_decode(line))
+
+
+def _decode(line):
+    return line.rstrip(b'\r').decode('utf-8', 'replace')
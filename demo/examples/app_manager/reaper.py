@@ -0,0 +1,147 @@
+""" Asynchronous removal of directory trees.
+
+Removing a tree is split in two: the tree is first renamed into a trash
+directory, which is a single atomic operation, and is then deleted file by
+file by a background thread. The background deletion is throttled so that it
+does not starve the rest of the app manager of disk bandwidth.
+"""
+
+import errno
+import os
+import threading
+import time
+import uuid
+from os.path import basename, join
+from Queue import Queue
+
+from traits.api import HasTraits, Any, Bool, Int, Str
+
+
+class Reaper(HasTraits):
+    """ Deletes trashed directory trees in a background thread. """
+
+    #: Directory the trees are moved into. It must be on the same file system
+    #: as the trees being removed for the move to be atomic.
+    trash_url = Str
+
+    #: Maximum number of files deleted per second.
+    max_files_per_second = Int(2000)
+
+    #: Number of trees waiting to be deleted.
+    pending = Int
+
+    def __init__(self, **traits):
+        super(Reaper, self).__init__(**traits)
+        self._lock = threading.Lock()
+        self._queue = Queue()
+
+    def start(self):
+        """ Start the background thread and queue the trees left behind in
+        the trash by a previous run.
+        """
+        with self._lock:
+            if self._started:
+                return
+
+            self._started = True
+
+        if os.path.isdir(self.trash_url):
+            for name in os.listdir(self.trash_url):
+                self._enqueue(join(self.trash_url, name), None, None)
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def trash(self, path, callback=None, done=None):
+        """ Move the tree at 'path' to the trash and queue it for deletion.
+
+        'callback', if given, is called as callback(files_deleted, files_total)
+        while the tree is being deleted, and 'done' without arguments once the
+        deletion is over, even if part of the tree was left in the trash.
+        """
+        try:
+            os.makedirs(self.trash_url)
+
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self.start()
+
+        trashed = join(self.trash_url, '%s-%s' % (basename(path), uuid.uuid4().hex))
+        os.rename(path, trashed)
+        self._enqueue(trashed, callback, done)
+
+        return trashed
+
+    #### Private protocol #####################################################
+
+    _lock = Any
+
+    _queue = Any
+
+    _started = Bool(False)
+
+    def _enqueue(self, path, callback, done):
+        with self._lock:
+            self.pending += 1
+
+        self._queue.put((path, callback, done))
+
+    def _run(self):
+        while True:
+            path, callback, done = self._queue.get()
+            try:
+                self._delete(path, callback)
+
+            except OSError:
+                # Whatever is left stays in the trash and is retried on the
+                # next start.
+                pass
+
+            with self._lock:
+                self.pending -= 1
+
+            if done is not None:
+                done()
+
+    def _delete(self, path, callback):
+        """ Delete the tree at 'path', throttled to 'max_files_per_second'. """
+        files, dirs = [], []
+        for root, dirnames, filenames in os.walk(path, topdown=False):
+            files.extend(join(root, filename) for filename in filenames)
+            dirs.append(root)
+
+        total = len(files)
+        batch_size = max(1, self.max_files_per_second // 20)
+        batch_started, batch_start = time.time(), 0
+        for deleted, filename in enumerate(files, 1):
+            _ignore_missing(os.remove, filename)
+            if deleted % batch_size and deleted < total:
+                continue
+
+            if callback is not None:
+                callback(deleted, total)
+
+            elapsed = time.time() - batch_started
+            min_elapsed = float(deleted - batch_start) / self.max_files_per_second
+            if elapsed < min_elapsed:
+                time.sleep(min_elapsed - elapsed)
+
+            batch_started, batch_start = time.time(), deleted
+
+        for directory in dirs:
+            _ignore_missing(os.rmdir, directory)
+
+        if callback is not None and not total:
+            callback(0, 0)
+
+
+def _ignore_missing(function, path):
+    try:
+        function(path)
+
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
@@ -0,0 +1,211 @@
+""" A pipelined scheduler for app installs.
+
+Every install goes through a fetch stage and an install stage, each served by
+its own bounded pool of worker threads, so that app N+1 is being fetched while
+app N is being installed.
+
+Given an ActionEngine, the stages run as coroutines on the engine instead and
+the number of workers limits how many jobs are in each stage at a time.
+"""
+
+import threading
+from Queue import Queue
+
+from traits.api import HasTraits, Any, Bool, Dict, Int, Set, Str
+
+from engine import Semaphore
+
+
+class ActionCancelledException(Exception):
+    pass
+
+
+class Job(HasTraits):
+    """ An app going through the install pipeline. """
+
+    #: Id of the app being installed.
+    id = Str
+
+    #: Callables run by the fetch and install stages respectively. With an
+    #: engine they must return a coroutine. A stage which is None is skipped,
+    #: eg. when resuming a job which was interrupted after its fetch.
+    fetch = Any
+    install = Any
+
+    #: Called as on_done(job, error) once the job has left the pipeline.
+    on_done = Any
+
+
+class InstallScheduler(HasTraits):
+    """ Runs installs through a fetch stage and an install stage. """
+
+    #: Number of worker threads serving each stage.
+    fetch_workers = Int(2)
+    install_workers = Int(1)
+
+    #: The ActionEngine to run the stages on, if any.
+    engine = Any
+
+    #: Number of jobs waiting for a worker in any stage.
+    queue_depth = Int
+
+    #: Number of jobs currently being worked on in any stage.
+    in_flight = Int
+
+    #: Jobs which have been submitted and have not yet left the pipeline.
+    jobs = Dict(Str, Job)
+
+    def __init__(self, **traits):
+        super(InstallScheduler, self).__init__(**traits)
+        self._lock = threading.RLock()
+        self._fetch_queue = Queue()
+        self._install_queue = Queue()
+
+    def submit(self, id, fetch, install, on_done=None):
+        """ Queue an install and return immediately.
+
+        Raises ValueError if a job with the same id is already scheduled.
+        """
+        job = Job(id=id, fetch=fetch, install=install, on_done=on_done)
+        with self._lock:
+            if id in self.jobs:
+                raise ValueError("App '%s' is already scheduled" % id)
+
+            self.jobs[id] = job
+            self._cancelled.discard(id)
+            if self.engine is None:
+                self._start_workers()
+
+            self.queue_depth += 1
+
+        if self.engine is None:
+            self._fetch_queue.put(job)
+
+        else:
+            self.engine.spawn(self._run_job(job))
+
+        return job
+
+    def cancel(self, id):
+        """ Cancel the job with the given id.
+
+        A job that has not started a stage yet is dropped when it reaches it;
+        a running stage can find out through 'is_cancelled'.
+        """
+        with self._lock:
+            if id in self.jobs:
+                self._cancelled.add(id)
+
+    def is_cancelled(self, id):
+        """ Return whether the job with the given id has been cancelled. """
+        return id in self._cancelled
+
+    #### Private protocol #####################################################
+
+    _lock = Any
+
+    _cancelled = Set(Str)
+
+    _fetch_queue = Any
+
+    _install_queue = Any
+
+    _started = Bool(False)
+
+    #: Semaphores limiting the jobs in each stage when running on an engine.
+    _stage_slots = Dict
+
+    def _start_workers(self):
+        if self._started:
+            return
+
+        for i in range(self.fetch_workers):
+            self._start_worker(self._fetch_queue, 'fetch', self._install_queue)
+
+        for i in range(self.install_workers):
+            self._start_worker(self._install_queue, 'install', None)
+
+        self._started = True
+
+    def _start_worker(self, queue, stage, next_queue):
+        thread = threading.Thread(
+            target=self._run_worker, args=(queue, stage, next_queue)
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _run_worker(self, queue, stage, next_queue):
+        while True:
+            job = queue.get()
+            with self._lock:
+                self.queue_depth -= 1
+                self.in_flight += 1
+
+            error = None
+            try:
+                if self.is_cancelled(job.id):
+                    raise ActionCancelledException(job.id)
+
+                if getattr(job, stage) is not None:
+                    getattr(job, stage)()
+
+            except Exception as e:
+                error = e
+
+            with self._lock:
+                self.in_flight -= 1
+                if error is None and next_queue is not None:
+                    self.queue_depth += 1
+
+            if error is None and next_queue is not None:
+                next_queue.put(job)
+
+            else:
+                self._finish(job, error)
+
+    def _run_job(self, job):
+        """ Run the job through both stages as a coroutine on the engine. """
+        if not self._stage_slots:
+            self._stage_slots = {
+                'fetch': Semaphore(self.fetch_workers),
+                'install': Semaphore(self.install_workers)
+            }
+
+        error = None
+        for stage in ('fetch', 'install'):
+            slots = self._stage_slots[stage]
+            yield slots.acquire()
+            with self._lock:
+                self.queue_depth -= 1
+                self.in_flight += 1
+
+            try:
+                if self.is_cancelled(job.id):
+                    raise ActionCancelledException(job.id)
+
+                if getattr(job, stage) is not None:
+                    yield self.engine.spawn(getattr(job, stage)())
+
+            except Exception as e:
+                error = e
+
+            finally:
+                slots.release()
+
+            with self._lock:
+                self.in_flight -= 1
+                if error is None and stage == 'fetch':
+                    self.queue_depth += 1
+
+            if error is not None:
+                break
+
+        self._finish(job, error)
+
+    def _finish(self, job, error):
+        with self._lock:
+            del self.jobs[job.id]
+            self._cancelled.discard(job.id)
+
+        if job.on_done is not None:
+            job.on_done(job, error)
@@ -0,0 +1,189 @@
+""" The persistent state of the installed apps.
+
+A StateStore is a small SQLite database next to the installed apps. It holds
+a row per installed app, keyed by its id, so that the installed apps are
+loaded with a single query at startup, and a journal of the actions in
+progress. An action is journaled before it starts and taken out of the
+journal in the same transaction that records its outcome, so the actions
+left in the journal at startup are exactly those which were interrupted.
+The journal records how far an action got, the last step it finished and
+where its fetch had got to, so that it can be resumed from there rather than
+restarted.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from os.path import exists
+
+#: The fields of an installed app record.
+INSTALLED_FIELDS = ('id', 'name', 'version', 'author', 'size')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS installed_apps (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    author TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS journal (
+    app_id TEXT PRIMARY KEY,
+    phase TEXT NOT NULL,
+    version TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    checkpoint TEXT
+);
+"""
+
+
+class StateStore(object):
+    """ A database of the installed apps and of the actions in progress. It
+    can be used from any thread.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        #: Whether the database was created rather than opened, eg. to import
+        #: the apps installed before there was one.
+        self.is_new = not exists(filename)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+
+        # With write-ahead logging commits do not wait for the disk, but the
+        # database survives a crash of the app manager.
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+
+        # Journals created before checkpoints were recorded.
+        columns = [
+            row[1] for row in
+            self._connection.execute('PRAGMA table_info(journal)').fetchall()
+        ]
+        if 'checkpoint' not in columns:
+            self._connection.execute(
+                'ALTER TABLE journal ADD COLUMN checkpoint TEXT'
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    #### Installed apps ####
+
+    def installed_apps(self):
+        """ Return the records of all installed apps as dicts, ordered by id.
+        """
+        with self._transaction() as connection:
+            rows = connection.execute(
+                'SELECT %s FROM installed_apps ORDER BY id'
+                % ', '.join(INSTALLED_FIELDS)
+            ).fetchall()
+
+        return [dict(zip(INSTALLED_FIELDS, row)) for row in rows]
+
+    def set_installed(self, records):
+        """ Record the apps as installed and end their journaled actions. """
+        with self._transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO installed_apps VALUES (?, ?, ?, ?, ?)',
+                [tuple(record[field] for field in INSTALLED_FIELDS)
+                 for record in records]
+            )
+            connection.executemany(
+                'DELETE FROM journal WHERE app_id = ?',
+                [(record['id'],) for record in records]
+            )
+
+    def set_removed(self, app_id):
+        """ Record the app as removed and end its journaled action. """
+        with self._transaction() as connection:
+            connection.execute(
+                'DELETE FROM installed_apps WHERE id = ?', (app_id,)
+            )
+            connection.execute('DELETE FROM journal WHERE app_id = ?', (app_id,))
+
+    #### Journal ####
+
+    def begin_action(self, app_id, phase, version=''):
+        """ Journal that an action of the given phase is in progress for the
+        app. If the same action is journaled already, eg. because it is being
+        resumed, it keeps its step and checkpoint.
+        """
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT phase, version FROM journal WHERE app_id = ?',
+                (app_id,)
+            ).fetchone()
+            if row != (phase, version):
+                connection.execute(
+                    'INSERT OR REPLACE INTO journal'
+                    ' (app_id, phase, version, step, started_at)'
+                    ' VALUES (?, ?, ?, 0, ?)',
+                    (app_id, phase, version, time.time())
+                )
+
+    def set_action_step(self, app_id, step):
+        """ Record the last step the journaled action of the app finished. """
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE journal SET step = ? WHERE app_id = ?', (step, app_id)
+            )
+
+    def set_action_checkpoint(self, app_id, checkpoint):
+        """ Record where the fetch of the journaled action of the app got to,
+        as a dict which can be saved as JSON.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE journal SET checkpoint = ? WHERE app_id = ?',
+                (json.dumps(checkpoint), app_id)
+            )
+
+    def end_action(self, app_id):
+        """ Take the action of the app out of the journal without recording
+        an outcome, eg. because it failed or was cancelled.
+        """
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM journal WHERE app_id = ?', (app_id,))
+
+    def pending_action(self, app_id):
+        """ Return (phase, version, step, checkpoint) of the journaled action
+        of the app, or None. The checkpoint is None unless one was recorded.
+        """
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT phase, version, step, checkpoint FROM journal'
+                ' WHERE app_id = ?',
+                (app_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        checkpoint = json.loads(row[3]) if row[3] is not None else None
+        return row[:3] + (checkpoint,)
+
+    def pending_actions(self):
+        """ Return (app_id, phase, version) of all journaled actions in the
+        order they were started.
+        """
+        with self._transaction() as connection:
+            return connection.execute(
+                'SELECT app_id, phase, version FROM journal ORDER BY started_at'
+            ).fetchall()
+
+    #### Private protocol #####################################################
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            with self._connection:
+                yield self._connection
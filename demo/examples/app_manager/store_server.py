@@ -0,0 +1,326 @@
+""" A stand-in store server serving a store directory over HTTP.
+
+Serves the files of the apps with support for keep-alive connections, HEAD
+requests and byte ranges, the delta signature of every file at its path plus
+'.sig', every app packed into a bundle at its id plus '.bundle', the
+checksums of its files and its bundle at its id plus '.checksums' (those the
+store publishes, or else hashed when the files change) and a
+listing of all apps at '/index.json' which honors If-None-Match and
+If-Modified-Since, as expected by HTTPStore. Bundles are packed when they are first requested
+and repacked when the files of the app change; a bundle file in the store
+directory is served as it is instead.
+
+Usage: python store_server.py [STORE_DIRECTORY] [PORT]
+"""
+
+import email.utils
+import json
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import urllib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from os.path import getmtime, getsize, isdir, isfile, join, normpath
+from SocketServer import ThreadingMixIn
+
+from bundle import pack
+from cache import hash_file
+from stores import BUNDLE_SUFFIX, CHECKSUMS_SUFFIX, INDEX_PATH, \
+    SIGNATURE_SUFFIX, DirectoryStore, tree_stat
+from verify import directory_checksums
+
+#: Size of the blocks files are sent in.
+BLOCK_SIZE = 256 * 1024
+
+
+class StoreServer(ThreadingMixIn, HTTPServer):
+    """ Serves a store directory. Use port 0 to pick a free port. """
+
+    daemon_threads = True
+
+    def __init__(self, directory, port=0, host='127.0.0.1'):
+        HTTPServer.__init__(self, (host, port), StoreRequestHandler)
+        self.store = DirectoryStore(url=directory)
+        self._index_lock = threading.Lock()
+        self._index = None
+        self._signatures = {}
+        self._checksums = {}
+        self._bundle_lock = threading.Lock()
+        self._bundle_dir = tempfile.mkdtemp(prefix='store-bundles-')
+        self._bundles = {}
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        """ Serve in a background thread. """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        shutil.rmtree(self._bundle_dir, ignore_errors=True)
+
+    def handle_error(self, request, client_address):
+        # Clients abort fetches by closing their connections.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def index(self):
+        """ Return (etag, mtime, body) of the listing of all apps. """
+        with self._index_lock:
+            validator, apps = self.store.listing(
+                self._index[0] if self._index is not None else None
+            )
+            if apps is not None:
+                index = dict(
+                    (id, dict(self.store.read_metadata(id), mtime=mtime))
+                    for id, mtime in apps.items()
+                )
+                body = json.dumps(index, sort_keys=True)
+                self._index = (validator, '"%r"' % validator, body)
+
+            store_mtime, etag, body = self._index
+
+        return etag, store_mtime, body
+
+    def signature(self, path):
+        """ Return the signature of the file as JSON, or None. """
+        stat = self.store.stat(path)
+        if stat is None:
+            return None
+
+        with self._index_lock:
+            cached = self._signatures.get(path)
+
+        if cached is None or cached[0] != stat:
+            body = json.dumps(self.store.signature(path))
+            cached = (stat, body)
+            with self._index_lock:
+                self._signatures[path] = cached
+
+        return cached[1]
+
+    def bundle(self, id):
+        """ Return (filename, hex digest) of the bundle of the app, or None
+        if there is no such app.
+        """
+        directory = self._directory(id)
+        if directory is None:
+            return None
+
+        prepacked = directory + BUNDLE_SUFFIX
+        if isfile(prepacked):
+            files = [(prepacked, getsize(prepacked), getmtime(prepacked))]
+
+        else:
+            files = tree_stat(directory)
+
+        with self._bundle_lock:
+            cached = self._bundles.get(id)
+            if cached is None or cached[0] != files:
+                if isfile(prepacked):
+                    filename = prepacked
+
+                else:
+                    filename = join(self._bundle_dir, id + BUNDLE_SUFFIX)
+                    pack(directory, filename)
+
+                cached = self._bundles[id] = (
+                    files, filename, hash_file(filename)
+                )
+
+        return cached[1:]
+
+    def checksums(self, id):
+        """ Return the checksums of the app and its bundle as JSON, or None.
+        """
+        bundle = self.bundle(id)
+        if bundle is None:
+            return None
+
+        checksums = self.store.checksums(id)
+        if checksums is None:
+            directory = self._directory(id)
+            files = tree_stat(directory)
+            with self._index_lock:
+                cached = self._checksums.get(id)
+
+            if cached is None or cached[0] != files:
+                cached = (files, directory_checksums(directory))
+                with self._index_lock:
+                    self._checksums[id] = cached
+
+            checksums = cached[1]
+
+        return json.dumps(dict(checksums, bundle=bundle[1]), sort_keys=True)
+
+    #### Private protocol #####################################################
+
+    def _directory(self, id):
+        directory = join(self.store.url, id)
+        if not id or '/' in id or id.startswith('.') or not isdir(directory):
+            return None
+
+        return directory
+
+
+class StoreRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+    #### Private protocol #####################################################
+
+    def _serve(self, send_body):
+        path = urllib.unquote(self.path.split('?', 1)[0]).lstrip('/')
+        if path == INDEX_PATH:
+            self._serve_index(send_body)
+            return
+
+        signed = path[:-len(SIGNATURE_SUFFIX)]
+        if path.endswith(SIGNATURE_SUFFIX) and self._filename(signed):
+            self._serve_json(self.server.signature(signed), send_body)
+            return
+
+        # Published checksums are served with that of the bundle added.
+        if path.endswith(CHECKSUMS_SUFFIX):
+            checksums = self.server.checksums(path[:-len(CHECKSUMS_SUFFIX)])
+            if checksums is not None:
+                self._serve_json(checksums, send_body)
+                return
+
+        filename = self._filename(path)
+        if filename is None and path.endswith(BUNDLE_SUFFIX):
+            bundle = self.server.bundle(path[:-len(BUNDLE_SUFFIX)])
+            filename = bundle[0] if bundle is not None else None
+
+        if filename is None:
+            self._send_empty(404)
+            return
+
+        self._serve_file(filename, send_body)
+
+    def _filename(self, path):
+        """ Return the name of the file at the path in the store, or None if
+        there is no such file.
+        """
+        root = normpath(self.server.store.url)
+        filename = normpath(join(root, path))
+        if not filename.startswith(root + os.sep) or not isfile(filename):
+            return None
+
+        return filename
+
+    def _serve_index(self, send_body):
+        etag, mtime, body = self.server.index()
+        last_modified = email.utils.formatdate(mtime, usegmt=True)
+
+        if self.headers.get('If-None-Match') == etag or (
+                'If-None-Match' not in self.headers
+                and _parse_date(self.headers.get('If-Modified-Since')) >= int(mtime)):
+            self._send_empty(304)
+            return
+
+        self._serve_json(
+            body, send_body, {'ETag': etag, 'Last-Modified': last_modified}
+        )
+
+    def _serve_json(self, body, send_body, headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _serve_file(self, filename, send_body):
+        size = getsize(filename)
+        start, end = 0, size
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and match.group(1):
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(size, int(match.group(2)) + 1)
+
+        if start >= end and size:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if match and match.group(1):
+            self.send_response(206)
+            self.send_header(
+                'Content-Range', 'bytes %d-%d/%d' % (start, end - 1, size)
+            )
+
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header(
+            'Last-Modified', email.utils.formatdate(getmtime(filename), usegmt=True)
+        )
+        self.end_headers()
+        if not send_body:
+            return
+
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining:
+                data = f.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    break
+
+                self.wfile.write(data)
+                remaining -= len(data)
+
+    def _send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def _parse_date(value):
+    if not value:
+        return -1
+
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return -1
+
+    return email.utils.mktime_tz(parsed)
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'store'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8002
+
+    server = StoreServer(directory, port)
+    print 'Serving', directory, 'at', server.url
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,811 @@
+""" Access to the stores apps are installed from.
+
+A store holds a directory per app. DirectoryStore reads a store on the local
+file system and HTTPStore one served over HTTP (eg. by 'store_server.py'),
+reusing keep-alive connections from a pool, fetching large files as byte
+ranges over several connections in parallel and resuming interrupted fetches
+from their '.part' files. HTTP stores also serve every app as a compressed
+bundle (see 'bundle.py'), which is extracted as it arrives, in order, from
+byte ranges fetched over several connections. Stores publish checksums of the
+files of every app, which fetched files are verified against (see
+'verify.py'); a directory store publishes them in a file next to the directory
+of the app. Use 'open_store' to get the store for a URL.
+"""
+
+import calendar
+import email.utils
+import httplib
+import json
+import os
+import threading
+import urlparse
+from collections import deque
+from contextlib import contextmanager
+from os.path import dirname, exists, getmtime, getsize, isdir, join, relpath
+from Queue import Empty, Queue
+
+from traits.api import HasTraits, Any, Int, Str
+
+from bundle import BundleExtractor
+from delta import signature
+from transfer import PART_SUFFIX, VERIFY_SIZE, commit_part_file, \
+    transfer_file
+
+#: Name of the optional per-app metadata file in the store.
+METADATA_FILENAME = 'app.json'
+
+#: Path of the listing of all apps served by an HTTP store.
+INDEX_PATH = 'index.json'
+
+#: Suffix of the path at which an HTTP store serves the signature of a file.
+SIGNATURE_SUFFIX = '.sig'
+
+#: Suffix of the path at which an HTTP store serves the bundle of an app.
+BUNDLE_SUFFIX = '.bundle'
+
+#: Suffix of the path at which a store publishes the checksums of an app.
+CHECKSUMS_SUFFIX = '.checksums'
+
+#: Suffix of the record of the segments of a part file which are complete.
+SEGMENTS_SUFFIX = '.segments'
+
+#: Seconds between progress reports while waiting for a segment.
+PROGRESS_INTERVAL = 0.1
+
+
+class StoreException(Exception):
+    pass
+
+
+class Store(HasTraits):
+    """ The interface of a store. Paths are relative to the store and use
+    '/' as the separator.
+    """
+
+    url = Str
+
+    def is_available(self):
+        """ Return whether the store can be reached. """
+        raise NotImplementedError
+
+    def listing(self, validator=None):
+        """ Return (validator, apps) where 'apps' maps the id of every app in
+        the store to the modification time of its directory.
+
+        If the store has not changed since 'validator' was returned by an
+        earlier call, 'apps' is None instead. Validators can be saved as JSON.
+        """
+        raise NotImplementedError
+
+    def read_metadata(self, id):
+        """ Return a dict with the 'size' of the app and, if the app declares
+        them, its 'version' and 'author'.
+        """
+        raise NotImplementedError
+
+    def stat(self, path):
+        """ Return (size, mtime) of the file or None if it does not exist. """
+        raise NotImplementedError
+
+    def list_files(self, id):
+        """ Return the paths of all files of the app, relative to its
+        directory.
+        """
+        raise NotImplementedError
+
+    def fetch(self, path, dst, callback=None, digest=None):
+        """ Fetch the file to 'dst', calling callback(bytes_done, bytes_total)
+        as it goes. The callback may raise to abort the fetch. 'digest', if
+        given, is updated with the contents of the file.
+        """
+        raise NotImplementedError
+
+    def fetch_bundle(self, id, directory, callback=None, verifier=None,
+                     offset=0, checkpoint=None):
+        """ Fetch all files of the app as a bundle and extract them into
+        'directory' as they arrive, calling callback(bytes_done, bytes_total)
+        as for 'fetch' and handing the files and the bundle to the verifier,
+        if any. Return the number of bytes fetched, or None if the store does
+        not provide bundles.
+
+        'checkpoint' and 'offset' are as for 'bundle.BundleExtractor', to
+        resume an interrupted fetch. The bundle itself is only verified when
+        the fetch starts at the beginning.
+        """
+        raise NotImplementedError
+
+    def checksums(self, id):
+        """ Return the checksums of the app as a dict with the hex digest of
+        every file by path under 'files' and, if the store provides bundles,
+        that of the bundle under 'bundle'. Return None if the store does not
+        provide checksums.
+        """
+        raise NotImplementedError
+
+    def read_range(self, path, start, end):
+        """ Return the bytes [start, end) of the file. """
+        raise NotImplementedError
+
+    def signature(self, path):
+        """ Return the delta signature of the file (see 'delta.signature') or
+        None if the store does not provide one.
+        """
+        raise NotImplementedError
+
+
+class DirectoryStore(Store):
+    """ A store in a directory on the local file system. """
+
+    def is_available(self):
+        return isdir(self.url)
+
+    def listing(self, validator=None):
+        store_mtime = getmtime(self.url)
+        if store_mtime == validator:
+            return validator, None
+
+        apps = {}
+        for id in os.listdir(self.url):
+            path = join(self.url, id)
+            if not id.startswith('.') and isdir(path):
+                apps[id] = getmtime(path)
+
+        return store_mtime, apps
+
+    def read_metadata(self, id):
+        path = join(self.url, id)
+        metadata = {}
+
+        metadata_filename = join(path, METADATA_FILENAME)
+        if exists(metadata_filename):
+            with open(metadata_filename, 'r') as f:
+                declared = json.load(f)
+
+            for field in ('version', 'author'):
+                if field in declared:
+                    metadata[field] = declared[field]
+
+        metadata['size'] = sum(
+            getsize(join(root, filename))
+            for root, dirs, filenames in os.walk(path)
+            for filename in filenames
+        )
+
+        return metadata
+
+    def stat(self, path):
+        filename = self._filename(path)
+        if not exists(filename):
+            return None
+
+        return getsize(filename), getmtime(filename)
+
+    def list_files(self, id):
+        path = join(self.url, id)
+        return sorted(
+            relpath(join(root, filename), path).replace(os.sep, '/')
+            for root, dirs, filenames in os.walk(path)
+            for filename in filenames
+        )
+
+    def fetch(self, path, dst, callback=None, digest=None):
+        return transfer_file(
+            self._filename(path), dst, callback=callback, digest=digest
+        )
+
+    def fetch_bundle(self, id, directory, callback=None, verifier=None,
+                     offset=0, checkpoint=None):
+        # Local files are copied faster than they could be packed.
+        return None
+
+    def checksums(self, id):
+        # Only published checksums are used, hashing the files of the app
+        # here would read all of them once more than fetching them does.
+        filename = join(self.url, id + CHECKSUMS_SUFFIX)
+        if not exists(filename):
+            return None
+
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+    def read_range(self, path, start, end):
+        with open(self._filename(path), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def signature(self, path):
+        filename = self._filename(path)
+        if not exists(filename):
+            return None
+
+        return signature(filename)
+
+    #### Private protocol #####################################################
+
+    def _filename(self, path):
+        return join(self.url, *path.split('/'))
+
+
+class ConnectionPool(object):
+    """ A pool of keep-alive HTTP connections to one server. """
+
+    def __init__(self, host, port=None, max_size=8, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = Queue()
+        self._slots = threading.Semaphore(max_size)
+
+    @contextmanager
+    def connection(self):
+        """ Lend a connection for a request. It is only reused if the request
+        went through without an exception and its response was read.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+
+            except Empty:
+                connection = httplib.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout
+                )
+
+            try:
+                yield connection
+
+            except:
+                connection.close()
+                raise
+
+            self._idle.put(connection)
+
+        finally:
+            self._slots.release()
+
+    def request(self, method, path, headers=None):
+        """ Make a request and return (status, headers, body). """
+        with self.connection() as connection:
+            response = self.send(connection, method, path, headers)
+            body = response.read()
+
+        return response.status, dict(response.getheaders()), body
+
+    def send(self, connection, method, path, headers=None):
+        """ Make a request on a connection from the pool and return the
+        response, which must be read before the connection is given back.
+        """
+        try:
+            connection.request(method, path, headers=headers or {})
+            return connection.getresponse()
+
+        except (httplib.BadStatusLine, httplib.CannotSendRequest):
+            # The server closed the idle connection, try again on a new one.
+            connection.close()
+            connection.request(method, path, headers=headers or {})
+            return connection.getresponse()
+
+
+class HTTPStore(Store):
+    """ A store served over HTTP with support for byte ranges. """
+
+    #: Files larger than this are fetched in segments of this size.
+    segment_size = Int(8 * 1024 * 1024)
+
+    #: Maximum number of segments fetched at the same time.
+    max_segments = Int(4)
+
+    #: Size of the blocks a response is read in.
+    block_size = Int(256 * 1024)
+
+    #: The pool of connections to the server.
+    pool = Any
+    def _pool_default(self):
+        parts = urlparse.urlsplit(self.url)
+        return ConnectionPool(
+            parts.hostname, parts.port, max_size=self.max_segments + 2
+        )
+
+    def is_available(self):
+        try:
+            status = self.pool.request('HEAD', self._path(INDEX_PATH))[0]
+
+        except (httplib.HTTPException, EnvironmentError):
+            return False
+
+        return status == httplib.OK
+
+    def listing(self, validator=None):
+        headers = {}
+        if validator:
+            etag, last_modified = validator
+            if etag:
+                headers['If-None-Match'] = etag
+
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        status, response_headers, body = self.pool.request(
+            'GET', self._path(INDEX_PATH), headers
+        )
+        if status == httplib.NOT_MODIFIED:
+            return validator, None
+
+        self._check(status, INDEX_PATH)
+        self._index = json.loads(body)
+        validator = [
+            response_headers.get('etag'), response_headers.get('last-modified')
+        ]
+        apps = dict(
+            (id, metadata['mtime']) for id, metadata in self._index.items()
+        )
+
+        return validator, apps
+
+    def read_metadata(self, id):
+        if self._index is None or id not in self._index:
+            self.listing()
+
+        metadata = dict(self._index[id])
+        del metadata['mtime']
+
+        return metadata
+
+    def stat(self, path):
+        status, headers, body = self.pool.request('HEAD', self._path(path))
+        if status == httplib.NOT_FOUND:
+            return None
+
+        self._check(status, path)
+
+        return int(headers['content-length']), _parse_http_date(
+            headers.get('last-modified')
+        )
+
+    def list_files(self, id):
+        # The store only lists the files of an app in its checksums.
+        checksums = self.checksums(id)
+        if not checksums or not checksums.get('files'):
+            raise StoreException(
+                '%s does not list the files of %s' % (self.url, id)
+            )
+
+        return sorted(checksums['files'])
+
+    def fetch(self, path, dst, callback=None, digest=None):
+        stat = self.stat(path)
+        if stat is None:
+            raise StoreException('%s not found in %s' % (path, self.url))
+
+        total = stat[0]
+        if dirname(dst) and not exists(dirname(dst)):
+            os.makedirs(dirname(dst))
+
+        # An interrupted fetch leaves its '.part' file behind to be resumed.
+        part_filename = dst + PART_SUFFIX
+        if total > self.segment_size:
+            self._fetch_segments(path, part_filename, stat, callback)
+            if digest is not None:
+                # The segments arrive out of order, so they can only be
+                # hashed from the file, while it is still in the page cache.
+                _hash_file_into(part_filename, digest)
+
+        else:
+            offset = self._verified_offset(path, part_filename, total)
+            with open(part_filename, 'r+b' if offset else 'wb') as f:
+                f.truncate(offset)
+
+            if digest is not None and offset:
+                _hash_file_into(part_filename, digest)
+
+            progress = [offset]
+            def report(count, total):
+                progress[0] += count
+                if callback is not None:
+                    callback(progress[0], total)
+
+            report(0, total)
+            if offset < total:
+                self._fetch_range(
+                    path, part_filename, offset, total, report, total, digest
+                )
+
+        commit_part_file(part_filename, dst)
+        return total
+
+    def fetch_bundle(self, id, directory, callback=None, verifier=None,
+                     offset=0, checkpoint=None):
+        path = id + BUNDLE_SUFFIX
+        stat = self.stat(path)
+        if stat is None:
+            return None
+
+        total = stat[0]
+        extractor = BundleExtractor(directory, verifier, offset, checkpoint)
+        hasher = None
+        if verifier is not None and not offset:
+            hasher = verifier.bundle_hasher()
+
+        def feed(data):
+            extractor.feed(data)
+            if hasher is not None:
+                hasher.update(data)
+
+        try:
+            if total - offset > self.segment_size:
+                self._stream_segments(path, offset, total, feed, callback)
+
+            else:
+                progress = [offset]
+                def report(count, total):
+                    progress[0] += count
+                    if callback is not None:
+                        callback(progress[0], total)
+
+                report(0, total)
+                self._stream_range(path, offset, total, feed, report, total)
+
+            extractor.close()
+
+        except:
+            extractor.abort()
+            raise
+
+        return total - offset
+
+    def read_range(self, path, start, end):
+        status, headers, body = self.pool.request(
+            'GET', self._path(path), {'Range': 'bytes=%d-%d' % (start, end - 1)}
+        )
+        if status != httplib.PARTIAL_CONTENT:
+            raise StoreException('%s does not support ranges' % self.url)
+
+        return body
+
+    def signature(self, path):
+        status, headers, body = self.pool.request(
+            'GET', self._path(path + SIGNATURE_SUFFIX)
+        )
+        if status == httplib.NOT_FOUND:
+            return None
+
+        self._check(status, path + SIGNATURE_SUFFIX)
+        return json.loads(body)
+
+    def checksums(self, id):
+        path = id + CHECKSUMS_SUFFIX
+        status, headers, body = self.pool.request('GET', self._path(path))
+        if status == httplib.NOT_FOUND:
+            return None
+
+        self._check(status, path)
+        return json.loads(body)
+
+    #### Private protocol #####################################################
+
+    #: The last listing, keyed by app id.
+    _index = Any
+
+    def _path(self, path):
+        return urlparse.urlsplit(self.url).path.rstrip('/') + '/' + path
+
+    def _check(self, status, path):
+        if status not in (httplib.OK, httplib.PARTIAL_CONTENT):
+            raise StoreException(
+                'Fetching %s from %s failed with status %d'
+                % (path, self.url, status)
+            )
+
+    def _fetch_range(self, path, part_filename, start, end, callback,
+                     total=None, digest=None):
+        """ Fetch the bytes [start, end) of the file into the part file,
+        calling callback(bytes, total) with the number of new bytes and
+        updating the digest, if any, with the bytes.
+        """
+        with open(part_filename, 'r+b') as f:
+            f.seek(start)
+            def write(data):
+                f.write(data)
+                if digest is not None:
+                    digest.update(data)
+
+            self._stream_range(path, start, end, write, callback, total)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _stream_range(self, path, start, end, consume, callback=None,
+                      total=None):
+        """ Fetch the bytes [start, end) of the file, passing them to
+        consume(data) as they arrive and calling callback(bytes, total) with
+        the number of new bytes.
+        """
+        total = end if total is None else total
+        headers = {}
+        if start or end < total:
+            headers['Range'] = 'bytes=%d-%d' % (start, end - 1)
+
+        with self.pool.connection() as connection:
+            response = self.pool.send(
+                connection, 'GET', self._path(path), headers
+            )
+            if headers and response.status != httplib.PARTIAL_CONTENT:
+                response.read()
+                raise StoreException('%s does not support ranges' % self.url)
+
+            self._check(response.status, path)
+            done = start
+            while done < end:
+                data = response.read(min(self.block_size, end - done))
+                if not data:
+                    raise StoreException(
+                        'Fetching %s from %s ended early' % (path, self.url)
+                    )
+
+                consume(data)
+                done += len(data)
+                if callback is not None:
+                    callback(len(data), total)
+
+    def _stream_segments(self, path, start, total, consume, callback):
+        """ Fetch the bytes [start, total) of the file in segments over
+        several connections at once and pass them to consume(data) in order.
+
+        Up to 'max_segments' segments are fetched ahead of the one being
+        consumed, and held in memory until their turn. Progress is reported
+        from the calling thread as the bytes are consumed, so that the
+        callback can abort the fetch.
+        """
+        starts = iter(range(start, total, self.segment_size))
+        aborted = threading.Event()
+
+        def report(count, total):
+            if aborted.is_set():
+                raise StoreException('Fetch aborted')
+
+        def fetch_segment(start, result):
+            blocks = []
+            try:
+                self._stream_range(
+                    path, start, min(start + self.segment_size, total),
+                    blocks.append, report, total
+                )
+
+            except Exception as e:
+                result.put(e)
+
+            else:
+                result.put(blocks)
+
+        pending = deque()
+        def fetch_next():
+            start = next(starts, None)
+            if start is not None:
+                result = Queue()
+                worker = threading.Thread(
+                    target=fetch_segment, args=(start, result)
+                )
+                worker.daemon = True
+                worker.start()
+                pending.append((worker, result))
+
+        done = start
+        try:
+            for i in range(self.max_segments):
+                fetch_next()
+
+            while pending:
+                worker, result = pending[0]
+                try:
+                    item = result.get(timeout=PROGRESS_INTERVAL)
+
+                except Empty:
+                    # Give the callback the chance to abort while waiting.
+                    if callback is not None:
+                        callback(done, total)
+
+                    continue
+
+                pending.popleft()
+                if isinstance(item, Exception):
+                    raise item
+
+                fetch_next()
+                for data in item:
+                    consume(data)
+                    done += len(data)
+                    if callback is not None:
+                        callback(done, total)
+
+        finally:
+            aborted.set()
+            for worker, result in pending:
+                worker.join()
+
+    def _verified_offset(self, path, part_filename, total):
+        """ Return the offset from which a fetch into 'part_filename' can be
+        resumed, once the tail of the part file matches the file in the store,
+        or 0 if it has to start from scratch.
+        """
+        if not exists(part_filename):
+            return 0
+
+        offset = getsize(part_filename)
+        if offset > total:
+            return 0
+
+        start = max(0, offset - VERIFY_SIZE)
+        with open(part_filename, 'rb') as f:
+            f.seek(start)
+            tail = f.read(offset - start)
+
+        if tail and self.read_range(path, start, offset) != tail:
+            return 0
+
+        return offset
+
+    def _fetch_segments(self, path, part_filename, stat, callback):
+        """ Fetch the file in segments over several connections at once.
+
+        The segments which are complete are recorded next to the part file,
+        so that an interrupted fetch of the same version of the file is
+        resumed with the others. Progress is reported from the calling
+        thread, so that the callback can abort the fetch.
+        """
+        total = stat[0]
+        record_filename = part_filename + SEGMENTS_SUFFIX
+        done_segments = _read_segment_record(
+            record_filename, part_filename, stat
+        )
+        if done_segments is None:
+            done_segments = set()
+            with open(part_filename, 'wb') as f:
+                f.truncate(total)
+
+            with open(record_filename, 'w') as f:
+                f.write(json.dumps(list(stat)) + '\n')
+
+        segments = Queue()
+        done = 0
+        for start in range(0, total, self.segment_size):
+            end = min(start + self.segment_size, total)
+            if start in done_segments:
+                done += end - start
+
+            else:
+                segments.put((start, end))
+
+        record_lock = threading.Lock()
+        def record(start):
+            with record_lock:
+                with open(record_filename, 'a') as f:
+                    f.write('%d\n' % start)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        progress = Queue()
+        aborted = threading.Event()
+
+        def report(count, total):
+            if aborted.is_set():
+                raise StoreException('Fetch aborted')
+
+            progress.put(count)
+
+        def fetch_segments():
+            try:
+                while not aborted.is_set():
+                    try:
+                        start, end = segments.get_nowait()
+
+                    except Empty:
+                        break
+
+                    self._fetch_range(
+                        path, part_filename, start, end, report, total
+                    )
+                    record(start)
+
+            except Exception as e:
+                progress.put(e)
+
+            else:
+                progress.put(None)
+
+        workers = []
+        for i in range(min(self.max_segments, segments.qsize())):
+            worker = threading.Thread(target=fetch_segments)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        running, error = len(workers), None
+        try:
+            if callback is not None:
+                callback(done, total)
+
+            while running:
+                item = progress.get()
+                if item is None or isinstance(item, Exception):
+                    running -= 1
+                    if item is not None and error is None:
+                        # Stop the other segments as soon as one fails.
+                        error = item
+                        aborted.set()
+
+                else:
+                    done += item
+                    if callback is not None:
+                        callback(done, total)
+
+            if error is not None:
+                raise error
+
+        finally:
+            aborted.set()
+            for worker in workers:
+                worker.join()
+
+        os.remove(record_filename)
+
+
+def open_store(url):
+    """ Return the store for the given URL, which is either an HTTP URL or
+    the path of a directory.
+    """
+    if url.startswith('http://'):
+        return HTTPStore(url=url)
+
+    return DirectoryStore(url=url)
+
+
+def tree_stat(directory):
+    """ Return the path, size and mtime of every file in the directory. """
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            filename = join(root, filename)
+            files.append(
+                (relpath(filename, directory), getsize(filename), getmtime(filename))
+            )
+
+    return sorted(files)
+
+
+def _read_segment_record(record_filename, part_filename, stat):
+    """ Return the starts of the segments of the part file which are
+    complete, or None if it is not a partial fetch of the file with the given
+    (size, mtime).
+    """
+    if stat[1] is None or not exists(record_filename) \
+            or not exists(part_filename) or getsize(part_filename) != stat[0]:
+        return None
+
+    with open(record_filename, 'r') as f:
+        lines = f.read().split('\n')
+
+    try:
+        if json.loads(lines[0]) != list(stat):
+            return None
+
+    except ValueError:
+        return None
+
+    # The last line may have been cut short.
+    return set(int(line) for line in lines[1:] if line.isdigit())
+
+
+def _hash_file_into(filename, digest):
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+
+            digest.update(data)
+
+
+def _parse_http_date(value):
+    if not value:
+        return None
+
+    return calendar.timegm(email.utils.parsedate(value))
@@ -0,0 +1,225 @@
+""" Tests of upgrades and of resuming actions from the state journal.
+
+Run with 'python -m unittest discover' from this directory.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from os.path import exists, join
+
+from app_manager import AppManager, FetchAction
+from state import StateStore
+from store_server import StoreServer
+
+
+class Interrupted(Exception):
+    pass
+
+
+class AppManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store_directory = join(self.directory, 'store')
+        self.local_directory = join(self.directory, 'local')
+        os.makedirs(self.local_directory)
+        self.files = {
+            'main.py': 'print "Hello world"\n',
+            'lib/data.bin': os.urandom(1024 * 1024),
+            'lib/more.bin': os.urandom(1024 * 1024),
+        }
+        for path, data in self.files.items():
+            self._write_store_file('app/' + path, data)
+
+        self._write_store_file('app/app.json', json.dumps({'version': '1.0'}))
+
+        self.server = StoreServer(self.store_directory)
+        self.server.start()
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.state.close()
+
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    #### Tests ################################################################
+
+    def test_upgrade_fetches_changed_blocks(self):
+        manager = self._manager()
+        app = manager.get_app('app')
+        self._install(manager, app)
+
+        data = bytearray(self.files['lib/data.bin'])
+        data[1000:1010] = 'X' * 10
+        self.files['lib/data.bin'] = bytes(data)
+        self._write_store_file('app/lib/data.bin', self.files['lib/data.bin'])
+        self._write_store_file('app/app.json', json.dumps({'version': '2.0'}))
+        self._touch_store('app')
+        manager.connect()
+        self.assertTrue(app.upgradable)
+
+        manager.upgrade_app(app)
+
+        self.assertEqual(app.status, 'installed')
+        self.assertEqual(app.installed_version, '2.0')
+        self._assert_installed('app')
+        upgrade = manager.metrics.sinks[0].phases['upgrade']
+        self.assertLess(upgrade.bytes, len(data) // 10)
+
+    def test_journal_survives_reopening(self):
+        filename = join(self.directory, 'state.db')
+        state = StateStore(filename)
+        state.begin_action('app', 'install', '1.0')
+        state.set_action_step('app', 3)
+        state.set_action_checkpoint('app', {'offset': 42})
+        state.close()
+
+        state = StateStore(filename)
+        try:
+            self.assertEqual(
+                state.pending_action('app'),
+                ('install', '1.0', 3, {'offset': 42})
+            )
+            self.assertEqual(
+                state.pending_actions(), [('app', 'install', '1.0')]
+            )
+
+            # Resuming the same action keeps its step.
+            state.begin_action('app', 'install', '1.0')
+            self.assertEqual(state.pending_action('app')[2], 3)
+
+            state.end_action('app')
+            self.assertEqual(state.pending_action('app'), None)
+
+        finally:
+            state.close()
+
+    def test_resume_interrupted_install(self):
+        state = StateStore(join(self.local_directory, '.state.db'))
+        state.begin_action('app', 'install', '1.0')
+        state.set_action_step('app', 6)
+        state.close()
+        for path, data in self.files.items():
+            self._write_local_file('app/' + path, data)
+
+        manager = self._manager()
+        manager.resume_actions()
+        self._wait(manager)
+
+        app = manager.get_app('app')
+        self.assertEqual(app.status, 'installed')
+        self.assertEqual([a.id for a in manager.installed_apps], ['app'])
+        self.assertEqual(manager.state.pending_actions(), [])
+
+    def test_resume_interrupted_fetch_from_checkpoint(self):
+        manager = self._manager()
+        app = manager.get_app('app')
+        manager.state.begin_action('app', 'fetch', app.version)
+        bundle_size = manager.store.stat('app.bundle')[0]
+
+        def progress(done, total):
+            if done > bundle_size // 2:
+                raise Interrupted()
+
+        action = FetchAction(
+            app=app, store_url=self.server.url,
+            local_url=self.local_directory, store=manager.store,
+            state=manager.state
+        )
+        with self.assertRaises(Interrupted):
+            action._fetch(progress)
+
+        offset = manager.state.pending_action('app')[3]['offset']
+        self.assertGreater(offset, 0)
+        manager.state.close()
+        self.managers.remove(manager)
+
+        manager = self._manager()
+        manager.resume_actions()
+        self._wait(manager)
+
+        app = manager.get_app('app')
+        self.assertEqual(app.status, 'installed')
+        self._assert_installed('app')
+        fetch = manager.metrics.sinks[0].phases['fetch']
+        self.assertEqual(fetch.bytes, bundle_size - offset)
+        self.assertEqual(manager.state.pending_actions(), [])
+
+    def test_resume_interrupted_remove(self):
+        manager = self._manager()
+        self._install(manager, manager.get_app('app'))
+        manager.state.begin_action('app', 'remove')
+        manager.state.close()
+        self.managers.remove(manager)
+
+        manager = self._manager()
+        manager.resume_actions()
+        self._wait(manager)
+
+        self.assertEqual(manager.installed_apps, [])
+        self.assertEqual(manager.state.pending_actions(), [])
+
+    #### Private protocol #####################################################
+
+    def _manager(self):
+        manager = AppManager(
+            STORE_URL=self.server.url, LOCAL_URL=self.local_directory,
+            CACHE_URL=join(self.directory, 'cache'), connect_delay=0,
+            install_step_delay=0
+        )
+        self.managers.append(manager)
+        manager.connect()
+
+        return manager
+
+    def _install(self, manager, app):
+        manager.install_app(app)
+        self._wait(manager)
+        self.assertEqual(app.status, 'installed')
+
+    def _wait(self, manager, timeout=30):
+        deadline = time.time() + timeout
+        while manager.scheduler.jobs:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.02)
+
+        # The reaper deletes the files of removed apps in the background.
+        while manager.reaper.pending:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.02)
+
+    def _assert_installed(self, id):
+        for path, data in self.files.items():
+            filename = join(self.local_directory, id, *path.split('/'))
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def _touch_store(self, id):
+        later = time.time() + 10
+        os.utime(join(self.store_directory, id), (later, later))
+        os.utime(self.store_directory, (later, later))
+
+    def _write_local_file(self, path, data):
+        self._write_file(self.local_directory, path, data)
+
+    def _write_store_file(self, path, data):
+        self._write_file(self.store_directory, path, data)
+
+    def _write_file(self, directory, path, data):
+        filename = join(directory, *path.split('/'))
+        if not exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
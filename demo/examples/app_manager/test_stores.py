@@ -0,0 +1,216 @@
+""" Tests of the HTTP store against a stand-in store server.
+
+Run with 'python -m unittest discover' from this directory.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from os.path import exists, join
+
+from store_server import StoreServer
+from stores import SEGMENTS_SUFFIX, open_store
+from transfer import PART_SUFFIX
+from verify import Verifier, new_digest
+
+#: Segment size of the store under test, small enough for the test files to
+#: be fetched in several segments.
+SEGMENT_SIZE = 128 * 1024
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(limit):
+    """ Return a progress callback which aborts a fetch after 'limit' bytes.
+    """
+    def callback(done, total):
+        if done >= limit:
+            raise Interrupted()
+
+    return callback
+
+
+def record_progress(calls):
+    return lambda done, total: calls.append(done)
+
+
+class HTTPStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store_directory = join(self.directory, 'store')
+        self.files = {
+            'main.py': 'print "Hello world"\n',
+            'data/small.bin': os.urandom(SEGMENT_SIZE // 2 + 3),
+            'data/large.bin': os.urandom(10 * SEGMENT_SIZE + 7),
+        }
+        for path, data in self.files.items():
+            self._write_store_file('app/' + path, data)
+
+        self.server = StoreServer(self.store_directory)
+        self.server.start()
+        self.store = open_store(self.server.url)
+        self.store.segment_size = SEGMENT_SIZE
+        self.store.block_size = 16 * 1024
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    #### Tests ################################################################
+
+    def test_fetch_range(self):
+        dst = join(self.directory, 'small.bin')
+        digest = new_digest()
+
+        fetched = self.store.fetch('app/data/small.bin', dst, digest=digest)
+
+        data = self.files['data/small.bin']
+        self.assertEqual(fetched, len(data))
+        self.assertEqual(self._read(dst), data)
+        self.assertEqual(digest.hexdigest(), hashlib.sha1(data).hexdigest())
+        self.assertFalse(exists(dst + PART_SUFFIX))
+
+    def test_fetch_range_resumes_from_part_file(self):
+        dst = join(self.directory, 'small.bin')
+        data = self.files['data/small.bin']
+        with open(dst + PART_SUFFIX, 'wb') as f:
+            f.write(data[:len(data) // 2])
+
+        calls = []
+        digest = new_digest()
+        self.store.fetch(
+            'app/data/small.bin', dst, callback=record_progress(calls),
+            digest=digest
+        )
+
+        self.assertEqual(calls[0], len(data) // 2)
+        self.assertEqual(self._read(dst), data)
+        self.assertEqual(digest.hexdigest(), hashlib.sha1(data).hexdigest())
+
+    def test_fetch_range_restarts_if_part_file_differs(self):
+        dst = join(self.directory, 'small.bin')
+        with open(dst + PART_SUFFIX, 'wb') as f:
+            f.write(os.urandom(1000))
+
+        calls = []
+        self.store.fetch(
+            'app/data/small.bin', dst, callback=record_progress(calls)
+        )
+
+        self.assertEqual(calls[0], 0)
+        self.assertEqual(self._read(dst), self.files['data/small.bin'])
+
+    def test_fetch_segments(self):
+        dst = join(self.directory, 'large.bin')
+        digest = new_digest()
+
+        self.store.fetch('app/data/large.bin', dst, digest=digest)
+
+        data = self.files['data/large.bin']
+        self.assertEqual(self._read(dst), data)
+        self.assertEqual(digest.hexdigest(), hashlib.sha1(data).hexdigest())
+        self.assertFalse(exists(dst + PART_SUFFIX))
+        self.assertFalse(exists(dst + PART_SUFFIX + SEGMENTS_SUFFIX))
+
+    def test_fetch_segments_resumes_completed_segments(self):
+        dst = join(self.directory, 'large.bin')
+        data = self.files['data/large.bin']
+        with self.assertRaises(Interrupted):
+            self.store.fetch(
+                'app/data/large.bin', dst,
+                callback=interrupt_after(len(data) // 2)
+            )
+
+        self.assertTrue(exists(dst + PART_SUFFIX + SEGMENTS_SUFFIX))
+
+        calls = []
+        self.store.fetch(
+            'app/data/large.bin', dst, callback=record_progress(calls)
+        )
+
+        self.assertGreater(calls[0], 0)
+        self.assertEqual(self._read(dst), data)
+        self.assertFalse(exists(dst + PART_SUFFIX + SEGMENTS_SUFFIX))
+
+    def test_listing_is_conditional(self):
+        validator, apps = self.store.listing()
+        self.assertEqual(sorted(apps), ['app'])
+
+        self.assertEqual(self.store.listing(validator), (validator, None))
+
+        self._write_store_file('other/main.py', 'print "Hello"\n')
+        later = time.time() + 10
+        os.utime(self.store_directory, (later, later))
+
+        new_validator, apps = self.store.listing(validator)
+        self.assertNotEqual(new_validator, validator)
+        self.assertEqual(sorted(apps), ['app', 'other'])
+
+    def test_fetch_bundle(self):
+        local_dir = join(self.directory, 'local', 'app')
+        verifier = Verifier(self.store.checksums('app'))
+
+        fetched = self.store.fetch_bundle('app', local_dir, verifier=verifier)
+
+        # The bundle is fetched in several segments.
+        self.assertGreater(fetched, SEGMENT_SIZE)
+        self.assertEqual(verifier.wait(), self._digests())
+        self._assert_fetched(local_dir)
+
+    def test_fetch_bundle_resumes_from_checkpoint(self):
+        local_dir = join(self.directory, 'local', 'app')
+        checksums = self.store.checksums('app')
+        checkpoints = []
+        with self.assertRaises(Interrupted):
+            self.store.fetch_bundle(
+                'app', local_dir, callback=interrupt_after(4 * SEGMENT_SIZE),
+                verifier=Verifier(checksums), checkpoint=checkpoints.append
+            )
+
+        self.assertTrue(checkpoints)
+
+        verifier = Verifier(checksums)
+        total = self.store.stat('app.bundle')[0]
+        fetched = self.store.fetch_bundle(
+            'app', local_dir, verifier=verifier, offset=checkpoints[-1]
+        )
+        verifier.hash_remaining(local_dir)
+
+        self.assertEqual(fetched, total - checkpoints[-1])
+        self.assertEqual(verifier.wait(), self._digests())
+        self._assert_fetched(local_dir)
+
+    #### Private protocol #####################################################
+
+    def _assert_fetched(self, local_dir):
+        for path, data in self.files.items():
+            self.assertEqual(self._read(join(local_dir, path)), data)
+
+    def _digests(self):
+        return dict(
+            (path, hashlib.sha1(data).hexdigest())
+            for path, data in self.files.items()
+        )
+
+    def _read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def _write_store_file(self, path, data):
+        filename = join(self.store_directory, *path.split('/'))
+        if not exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
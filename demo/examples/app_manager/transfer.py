@@ -0,0 +1,274 @@
+""" A streaming, resumable file transfer engine.
+
+Files are copied into a '.part' file next to the destination and renamed into
+place only once the copy is complete, so that an interrupted transfer never
+leaves a half written file behind. An interrupted transfer is resumed from the
+end of the '.part' file once its tail has been verified against the source.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+import threading
+import time
+from os.path import dirname, exists, getsize
+
+#: Suffix of the temporary file that a transfer writes into.
+PART_SUFFIX = '.part'
+
+#: Number of bytes at the end of a partial file that are compared against the
+#: source before a transfer is resumed.
+VERIFY_SIZE = 64 * 1024
+
+#: Bounds for the adaptive chunk size used when copying through user space.
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+
+#: The adaptive chunk size aims at roughly this many seconds per chunk, which
+#: keeps progress updates flowing without paying a syscall per few kilobytes.
+TARGET_CHUNK_TIME = 0.05
+
+#: errno values which mean that the kernel copy is not supported for this
+#: pair of files and that we should fall back to copying through user space.
+_KERNEL_COPY_UNSUPPORTED = set([
+    errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EBADF,
+    getattr(errno, 'ENOTSUP', errno.EINVAL),
+    getattr(errno, 'EOPNOTSUPP', errno.EINVAL),
+])
+
+#: The kernel side copy, looked up when it is first needed.
+_copy_function = None
+_copy_function_looked_up = False
+_copy_function_lock = threading.Lock()
+
+
+def transfer_file(src, dst, callback=None, digest=None):
+    """ Copy the file 'src' to 'dst' and return the number of bytes copied.
+
+    'callback', if given, is called as callback(bytes_done, bytes_total) after
+    every chunk. It may raise an exception to abort the transfer, in which case
+    the partial file is left behind to be resumed by the next transfer.
+
+    'digest', if given, is updated with the contents of the file from the
+    buffers they are copied through, so the kernel side copy is not used.
+    """
+    total = getsize(src)
+    part_filename = dst + PART_SUFFIX
+
+    if dirname(dst) and not exists(dirname(dst)):
+        os.makedirs(dirname(dst))
+
+    with open(src, 'rb') as fr:
+        offset = _verified_offset(fr, part_filename, total)
+        mode = 'r+b' if offset else 'wb'
+        with open(part_filename, mode) as fw:
+            fw.seek(offset)
+            fw.truncate()
+            if callback is not None:
+                callback(offset, total)
+
+            copied = None
+            if digest is None:
+                copied = _kernel_copy(fr, fw, offset, total, callback)
+
+            else:
+                _hash_prefix(part_filename, offset, digest)
+
+            if copied is None:
+                copied = _buffered_copy(fr, fw, offset, total, callback, digest)
+
+            fw.flush()
+            os.fsync(fw.fileno())
+
+    commit_part_file(part_filename, dst)
+    return copied
+
+
+def _verified_offset(fr, part_filename, total):
+    """ Return the offset from which a transfer into 'part_filename' can be
+    resumed, or 0 if it has to start from scratch.
+    """
+    if not exists(part_filename):
+        return 0
+
+    offset = getsize(part_filename)
+    if offset > total:
+        return 0
+
+    start = max(0, offset - VERIFY_SIZE)
+    with open(part_filename, 'rb') as fp:
+        fp.seek(start)
+        tail = fp.read(offset - start)
+
+    fr.seek(start)
+    if fr.read(offset - start) != tail:
+        return 0
+
+    return offset
+
+
+def _kernel_copy(fr, fw, offset, total, callback):
+    """ Copy the rest of the file using a kernel side copy.
+
+    Returns the number of bytes copied, or None if no kernel side copy is
+    available for these files.
+    """
+    copy = _get_kernel_copy()
+    if copy is None:
+        return None
+
+    in_fd, out_fd = fr.fileno(), fw.fileno()
+    done = offset
+    chunk_size = MAX_CHUNK_SIZE
+    while done < total:
+        try:
+            sent = copy(in_fd, out_fd, done, min(chunk_size, total - done))
+
+        except OSError as e:
+            if done == offset and e.errno in _KERNEL_COPY_UNSUPPORTED:
+                return None
+            raise
+
+        if sent == 0:
+            break
+
+        done += sent
+        if callback is not None:
+            callback(done, total)
+
+    fr.seek(done)
+    fw.seek(done)
+    return done - offset
+
+
+def _get_kernel_copy():
+    """ Return a function copy(in_fd, out_fd, offset, count) which copies
+    inside the kernel, or None if the platform does not provide one.
+    """
+    global _copy_function, _copy_function_looked_up
+    with _copy_function_lock:
+        if not _copy_function_looked_up:
+            _copy_function = _look_up_kernel_copy()
+            _copy_function_looked_up = True
+
+    return _copy_function
+
+
+def _look_up_kernel_copy():
+    """ Return copy_file_range or sendfile from the C library of Linux, which
+    are not exposed by the os module, or None.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    except OSError:
+        return None
+
+    offset_p = ctypes.POINTER(ctypes.c_int64)
+    if hasattr(libc, 'copy_file_range'):
+        copy_file_range = libc.copy_file_range
+        copy_file_range.argtypes = [
+            ctypes.c_int, offset_p, ctypes.c_int, offset_p, ctypes.c_size_t,
+            ctypes.c_uint
+        ]
+        copy_file_range.restype = ctypes.c_ssize_t
+
+        def copy(in_fd, out_fd, offset, count):
+            in_offset = ctypes.c_int64(offset)
+            out_offset = ctypes.c_int64(offset)
+            return _check_result(copy_file_range(
+                in_fd, ctypes.byref(in_offset), out_fd,
+                ctypes.byref(out_offset), count, 0
+            ))
+
+        return copy
+
+    sendfile = getattr(libc, 'sendfile64', None)
+    if sendfile is not None:
+        sendfile.argtypes = [
+            ctypes.c_int, ctypes.c_int, offset_p, ctypes.c_size_t
+        ]
+        sendfile.restype = ctypes.c_ssize_t
+
+        def copy(in_fd, out_fd, offset, count):
+            # sendfile writes at the position of the output file.
+            os.lseek(out_fd, offset, os.SEEK_SET)
+            in_offset = ctypes.c_int64(offset)
+            return _check_result(
+                sendfile(out_fd, in_fd, ctypes.byref(in_offset), count)
+            )
+
+        return copy
+
+    return None
+
+
+def _check_result(result):
+    """ Return the result of a C library call or raise its error. """
+    if result < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+    return result
+
+
+def _hash_prefix(part_filename, offset, digest):
+    """ Update the digest with the part of a resumed transfer done earlier.
+    """
+    with open(part_filename, 'rb') as fp:
+        remaining = offset
+        while remaining:
+            data = fp.read(min(MAX_CHUNK_SIZE, remaining))
+            digest.update(data)
+            remaining -= len(data)
+
+
+def _buffered_copy(fr, fw, offset, total, callback, digest=None):
+    """ Copy the rest of the file through user space with an adaptive chunk
+    size.
+    """
+    fr.seek(offset)
+    done = offset
+    chunk_size = MIN_CHUNK_SIZE
+    while True:
+        started = time.time()
+        data = fr.read(chunk_size)
+        if not data:
+            break
+
+        fw.write(data)
+        if digest is not None:
+            digest.update(data)
+
+        done += len(data)
+        if callback is not None:
+            callback(done, total)
+
+        chunk_size = _adapt_chunk_size(chunk_size, time.time() - started)
+
+    return done - offset
+
+
+def _adapt_chunk_size(chunk_size, elapsed):
+    """ Return the chunk size to use next given how long the last chunk took.
+    """
+    if elapsed < TARGET_CHUNK_TIME / 2:
+        chunk_size *= 2
+
+    elif elapsed > TARGET_CHUNK_TIME * 2:
+        chunk_size //= 2
+
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, chunk_size))
+
+
+def commit_part_file(part_filename, dst):
+    """ Atomically move a completed '.part' file to its destination. """
+    if os.name == 'nt' and exists(dst):
+        os.remove(dst)
+
+    os.rename(part_filename, dst)
@@ -0,0 +1,251 @@
+""" Verification of fetched files against the checksums published by a store.
+
+Files are hashed from the very buffers they are written from, so verifying
+them takes no second pass over the data. The hashing runs in a pool of
+threads, where it overlaps the transfer and where the files of a bundle are
+hashed in parallel, as hashlib releases the GIL while it hashes.
+
+A directory store publishes the checksums of every app in a file next to its
+directory, which is written from the files of the apps with:
+
+Usage: python verify.py STORE_DIRECTORY
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from os.path import exists, isdir, join, relpath
+
+from cache import hash_file
+from stores import CHECKSUMS_SUFFIX
+
+#: Number of threads hashing files.
+HASH_WORKERS = 4
+
+#: Number of buffers a file may be ahead of its hashing before its updates
+#: wait for the hashing to catch up.
+MAX_PENDING_BUFFERS = 16
+
+
+class VerificationException(Exception):
+
+    def __init__(self, paths):
+        super(VerificationException, self).__init__(
+            'Checksum mismatch: '
+            + ', '.join(path or 'the bundle' for path in paths)
+        )
+
+        #: The paths of the files which did not match, None for the bundle.
+        self.paths = paths
+
+
+def new_digest():
+    """ Return a new hash object of the kind checksums are computed with,
+    the same as 'cache.hash_file', so that verified digests can be reused by
+    the bundle cache.
+    """
+    return hashlib.sha1()
+
+
+def directory_checksums(directory):
+    """ Return the checksums of the files in the directory, as a dict with the
+    hex digest of every file, by path, under 'files'.
+    """
+    files = {}
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            filename = join(root, filename)
+            path = relpath(filename, directory).replace(os.sep, '/')
+            files[path] = hash_file(filename)
+
+    return {'files': files}
+
+
+def publish_checksums(store_directory):
+    """ Write the checksums of the files of every app in the store directory
+    next to the directory of the app, and return the ids of the apps.
+    """
+    ids = []
+    for id in sorted(os.listdir(store_directory)):
+        directory = join(store_directory, id)
+        if id.startswith('.') or not isdir(directory):
+            continue
+
+        with open(directory + CHECKSUMS_SUFFIX, 'w') as f:
+            json.dump(directory_checksums(directory), f, sort_keys=True)
+
+        ids.append(id)
+
+    return ids
+
+
+class Verifier(object):
+    """ Verifies the files of a fetch against the checksums of the app.
+
+    'checksums' is a dict as returned by Store.checksums, with the hex digest
+    of every file by path under 'files' and, optionally, that of the bundle
+    under 'bundle'.
+    """
+
+    def __init__(self, checksums):
+        self.checksums = checksums
+        self._hashers = {}
+        self._lock = threading.Lock()
+
+    def hasher(self, path):
+        """ Return the hasher to update with the contents of the file. """
+        hasher = _Hasher()
+        with self._lock:
+            self._hashers[path] = hasher
+
+        return hasher
+
+    def bundle_hasher(self):
+        """ Return the hasher to update with the bytes of the bundle, or None
+        if the files are verified one by one, which covers every byte that
+        gets installed without hashing the data twice.
+        """
+        if self.checksums.get('files') or 'bundle' not in self.checksums:
+            return None
+
+        return self.hasher(None)
+
+    def hash_remaining(self, directory):
+        """ Hash the files of the app in 'directory' which were not handed to
+        the verifier, eg. those extracted before an interrupted fetch was
+        resumed.
+        """
+        with self._lock:
+            paths = set(self.checksums.get('files', {})) - set(self._hashers)
+
+        for path in paths:
+            filename = join(directory, *path.split('/'))
+            if exists(filename):
+                result = _get_pool().apply_async(hash_file, (filename,))
+                with self._lock:
+                    self._hashers[path] = _FileHasher(result)
+
+    def wait(self):
+        """ Wait for all files to be hashed and return their hex digests by
+        path. Raise a VerificationException if any of them does not match or,
+        if the checksums list the files of the app, if any of them was not
+        fetched or any other file was.
+        """
+        with self._lock:
+            hashers = self._hashers.items()
+
+        files = self.checksums.get('files', {})
+        digests = {}
+        failed = []
+        for path, hasher in hashers:
+            digest = hasher.hexdigest()
+            if path is None:
+                expected = self.checksums.get('bundle')
+
+            else:
+                expected = files.get(path)
+                digests[path] = digest
+
+            if expected is None and path is not None and files:
+                # Not a file of the app.
+                failed.append(path)
+
+            elif expected is not None and digest != expected:
+                failed.append(path)
+
+        failed.extend(set(files) - set(digests))
+
+        if failed:
+            raise VerificationException(sorted(failed))
+
+        return digests
+
+
+#### Private protocol #########################################################
+
+#: The pool of hashing threads, started when it is first needed.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(HASH_WORKERS)
+
+    return _pool
+
+
+class _FileHasher(object):
+    """ The hasher of a file which is hashed from the disk in the pool. """
+
+    def __init__(self, result):
+        self._result = result
+
+    def hexdigest(self):
+        return self._result.get()
+
+
+class _Hasher(object):
+    """ Hashes the buffers it is updated with in the pool, in order. Updates
+    wait while the hashing is MAX_PENDING_BUFFERS behind, so that data which
+    arrives faster than it is hashed is not all held in memory.
+    """
+
+    def __init__(self):
+        self._digest = new_digest()
+        self._buffers = deque()
+        self._changed = threading.Condition()
+        self._draining = False
+
+    def update(self, data):
+        with self._changed:
+            while len(self._buffers) >= MAX_PENDING_BUFFERS:
+                self._changed.wait()
+
+            self._buffers.append(data)
+            if self._draining:
+                return
+
+            self._draining = True
+
+        _get_pool().apply_async(self._drain)
+
+    def hexdigest(self):
+        """ Wait for the buffers to be hashed and return the hex digest. """
+        with self._changed:
+            while self._draining:
+                self._changed.wait()
+
+        return self._digest.hexdigest()
+
+    def _drain(self):
+        # Only one drain runs per hasher at a time, which keeps the order.
+        while True:
+            with self._changed:
+                if not self._buffers:
+                    self._draining = False
+                    self._changed.notify_all()
+                    return
+
+                data = self._buffers.popleft()
+                self._changed.notify_all()
+
+            self._digest.update(data)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print __doc__
+        return
+
+    for id in publish_checksums(sys.argv[1]):
+        print 'Published the checksums of', id
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#### Imports ####
+import weakref
+
+import numpy as np
+from traits.api import HasTraits, Any, Array, Event, Int, Property, Str
+from jigna.api import Template, QtApp
+
+#### Domain model ####
+
+class EmployeeTable(HasTraits):
+    """ Many employees stored column by column in NumPy arrays.
+
+    Updates are vectorized over a selection of rows and fire a single
+    'salaries_changed' event with the indices of the rows that changed. Views
+    bind to rows through the lightweight proxies returned by 'row', which are
+    only created for the rows that are actually displayed.
+    """
+
+    names = Array(dtype=object)
+
+    salaries = Array(dtype=np.int64)
+
+    count = Property(Int, depends_on='names')
+    def _get_count(self):
+        return len(self.names)
+
+    #: Fired with the indices of the rows whose salary changed.
+    salaries_changed = Event
+
+    #: The rows shown in the view.
+    page = Property(depends_on='names, page_size')
+    def _get_page(self):
+        return [self.row(index) for index in range(min(self.page_size, self.count))]
+
+    page_size = Int(20)
+
+    def __init__(self, **traits):
+        super(EmployeeTable, self).__init__(**traits)
+        self._rows = weakref.WeakValueDictionary()
+
+    def row(self, index):
+        """ Return the proxy of the row at the given index. """
+        row = self._rows.get(index)
+        if row is None:
+            row = self._rows[index] = EmployeeRow(table=self, index=index)
+
+        return row
+
+    def update_salary(self, selection=None):
+        """ Give a 20% raise to the selected rows (all of them by default).
+
+        'selection' is a boolean mask or an array of row indices.
+        """
+        indices = self._indices(selection)
+        old = self.salaries[indices]
+        self.salaries[indices] += (0.2 * old).astype(np.int64)
+
+        self._notify_rows(indices, old)
+        self.salaries_changed = indices
+
+    def update_salary_below(self, salary):
+        """ Give a 20% raise to everyone earning less than 'salary'. """
+        self.update_salary(self.salaries < int(salary))
+
+    #### Private protocol ####
+
+    _rows = Any
+
+    def _indices(self, selection):
+        if selection is None:
+            return np.arange(self.count)
+
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            return np.flatnonzero(selection)
+
+        # An empty list makes a float array, which cannot index.
+        return selection.astype(np.intp)
+
+    def _notify_rows(self, indices, old):
+        """ Notify the live row proxies among the changed rows. """
+        if not len(self._rows):
+            return
+
+        positions = dict((index, i) for i, index in enumerate(indices.tolist()))
+        for index, row in list(self._rows.items()):
+            i = positions.get(index)
+            if i is not None:
+                row.trait_property_changed('salary', int(old[i]), row.salary)
+
+class EmployeeRow(HasTraits):
+    """ A view of one row of an EmployeeTable. """
+
+    table = Any
+
+    index = Int
+
+    name = Property(Str)
+    def _get_name(self):
+        return self.table.names[self.index]
+
+    salary = Property(Int)
+    def _get_salary(self):
+        return int(self.table.salaries[self.index])
+
+    def update_salary(self):
+        self.table.update_salary([self.index])
+
+def make_employees(count, seed=0):
+    rng = np.random.RandomState(seed)
+    return EmployeeTable(
+        names=np.array(['Employee %d' % i for i in range(count)], dtype=object),
+        salaries=rng.randint(1000, 5000, size=count).astype(np.int64)
+    )
+
+employees = make_employees(100000)
+
+#### UI layer ####
+
+body_html = """
+  <div style='font-size: 20px'>
+    {{employees.count}} employees <br/>
+
+    <button ng-click='employees.update_salary()'>
+        UPDATE ALL SALARIES
+    </button>
+    <button ng-click='employees.update_salary_below(2000)'>
+        UPDATE SALARIES BELOW $2000
+    </button>
+
+    <div ng-repeat='employee in employees.page'>
+      {{employee.name}}: ${{employee.salary}}
+      <button ng-click='employee.update_salary()'>UPDATE SALARY</button>
+    </div>
+  </div>
+"""
+template = Template(body_html=body_html)
+
+#### Entry point ####
+
+def main():
+    app = QtApp(template=template, context={'employees': employees})
+    app.start()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+""" Server side syntax highlighting of the example code.
+
+Code is highlighted with Pygments into HTML that uses the CSS classes of
+'css/pygments.css'. Highlighted code is cached by a hash of the code, so each
+distinct snippet is only highlighted once.
+"""
+
+import hashlib
+import threading
+
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import HtmlLexer, PythonLexer
+
+#: The lexers for the supported languages.
+LEXERS = {
+    'python': PythonLexer,
+    'html': HtmlLexer,
+}
+
+#: The style 'css/pygments.css' was generated with, using
+#: HtmlFormatter(style=STYLE).get_style_defs('.highlight').
+STYLE = 'default'
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def highlight_code(code, language):
+    """ Return the code in the given language as highlighted HTML. """
+    if isinstance(code, type(u'')):
+        code = code.encode('utf-8')
+
+    key = hashlib.sha1(language.encode('utf-8') + b'\0' + code).hexdigest()
+    with _lock:
+        html = _cache.get(key)
+
+    if html is None:
+        lexer = LEXERS[language]()
+        formatter = HtmlFormatter(nowrap=True, style=STYLE)
+        html = highlight(code.decode('utf-8'), lexer, formatter)
+        with _lock:
+            _cache[key] = html
+
+    return html
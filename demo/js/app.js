@@ -13,29 +13,11 @@ app.controller('DemoController', function($scope){
     };
 });
 
-app.directive('highlight', function(){
+app.directive('injectHtml', function(){
     return function(scope, element, attrs){
-
-         var entityMap = {
-            "&": "&amp;",
-            "<": "&lt;",
-            ">": "&gt;",
-            '"': '&quot;',
-            "'": '&#39;',
-            "/": '&#x2F;'
-          };
-
-          function escapeHtml(string) {
-            return String(string).replace(/[&<>"'\/]/g, function (s) {
-              return entityMap[s];
-            });
-          }
-
-        scope.$watch(attrs.highlight, function(code){
-            if (code.length) {
-                element.html(escapeHtml(code));
-                hljs.highlightBlock(element[0]);
-            }
+        // The html is highlighted on the Python side, just put it in.
+        scope.$watch(attrs.injectHtml, function(html){
+            element.html(html || '');
         });
     };
 });
@@ -0,0 +1,51 @@
+""" Discovery of jigna examples.
+
+An example is a module which separates its domain model from its UI layer with
+the '#### Domain model ####' and '#### UI layer ####' markers. Examples are
+either modules directly in the examples root, or a module with the same name
+as the directory it is in (eg. 'app_manager/app_manager.py').
+"""
+
+import os
+from os.path import isdir, isfile, join
+
+#: The markers every example module contains.
+DOMAIN_MODEL_MARKER = '#### Domain model ####'
+UI_LAYER_MARKER = '#### UI layer ####'
+
+
+def discover_examples(root):
+    """ Return a list of (ID, example_root) for the examples in 'root', sorted
+    by ID.
+    """
+    if not isdir(root):
+        return []
+
+    examples = []
+    for name in sorted(os.listdir(root)):
+        path = join(root, name)
+        if name.endswith('.py') and _is_example(path):
+            examples.append((name[:-3], root))
+
+        elif isdir(path) and _is_example(join(path, name + '.py')):
+            examples.append((name, path))
+
+    return examples
+
+
+def _is_example(filename):
+    """ Return whether the module contains both example markers.
+
+    The file is read line by line and only up to the second marker.
+    """
+    if not isfile(filename):
+        return False
+
+    markers = set([DOMAIN_MODEL_MARKER, UI_LAYER_MARKER])
+    with open(filename, 'r') as f:
+        for line in f:
+            markers.discard(line.strip())
+            if not markers:
+                return True
+
+    return False
@@ -0,0 +1,65 @@
+""" A shared cache of example source files.
+
+Files are read once and kept until their modification time or size changes.
+Values derived from a file's contents can be memoized on its cache entry, so
+they are recomputed only when the file itself changes.
+"""
+
+import os
+import threading
+
+
+class SourceEntry(object):
+    """ The contents of a source file at a given modification time and size.
+    """
+
+    def __init__(self, path, key, text):
+        self.path = path
+        self.key = key
+        self.text = text
+        self._memo = {}
+
+    def memoize(self, name, function):
+        """ Return function(), computing it only once for this entry. """
+        if name not in self._memo:
+            self._memo[name] = function()
+
+        return self._memo[name]
+
+
+class SourceCache(object):
+    """ A cache of source files keyed on (path, mtime, size). """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """ Return the SourceEntry for the current contents of the file. """
+        stat = os.stat(path)
+        key = (stat.st_mtime, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(path)
+
+        if entry is None or entry.key != key:
+            with open(path, 'r') as f:
+                entry = SourceEntry(path, key, f.read())
+
+            with self._lock:
+                self._entries[path] = entry
+
+        return entry
+
+    def invalidate(self, path=None):
+        """ Drop the given file, or every file, from the cache. """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+
+            else:
+                self._entries.pop(path, None)
+
+
+#: The cache shared by all examples.
+source_cache = SourceCache()
@@ -0,0 +1,190 @@
+""" Supervision of the processes started for apps and examples.
+
+The supervisor caps the number of processes running per key (eg. an app or
+example id) and overall, hands back the running process instead of starting a
+duplicate, applies resource limits to every process and reaps processes that
+have exited from a single monitor thread.
+"""
+
+import threading
+import time
+from subprocess import PIPE, STDOUT, Popen
+
+from traits.api import HasTraits, Any, Bool, Event, Float, Instance, Int, \
+    List, Str
+
+from output import SUPPORTED as CAPTURE_OUTPUT, OutputBuffer, OutputPump
+
+try:
+    import resource
+
+except ImportError:
+    resource = None
+
+
+class TooManyProcessesException(Exception):
+    pass
+
+
+class SupervisedProcess(HasTraits):
+    """ A process started through the supervisor. """
+
+    #: The key the process was started for.
+    key = Str
+
+    #: The underlying Popen object.
+    process = Any
+
+    pid = Int
+
+    #: Whether the process is still running.
+    running = Bool(True)
+
+    #: The exit code of the process once it has exited.
+    exit_code = Any
+
+    #: Seconds it took to start the process.
+    spawn_latency = Float
+
+    #: Fired when the process was asked to be started again while running.
+    focus_requested = Event
+
+    #: The output of the process, if it is captured.
+    output = Instance(OutputBuffer)
+
+
+class ProcessSupervisor(HasTraits):
+    """ Starts, limits and reaps processes. """
+
+    #: Maximum number of processes running at the same time.
+    max_processes = Int(8)
+
+    #: Maximum number of processes running for the same key.
+    max_per_key = Int(1)
+
+    #: Limit on the CPU time of every process in seconds, 0 for no limit.
+    cpu_limit = Int(0)
+
+    #: Limit on the address space of every process in bytes, 0 for no limit.
+    memory_limit = Int(0)
+
+    #: Seconds between checks for processes that have exited.
+    poll_interval = Float(0.5)
+
+    #: The processes which are running.
+    processes = List(SupervisedProcess)
+
+    #: The number of processes which are running.
+    running_count = Int
+
+    #: Reads the output of the processes.
+    pump = Instance(OutputPump, ())
+
+    def __init__(self, **traits):
+        super(ProcessSupervisor, self).__init__(**traits)
+        self._lock = threading.RLock()
+
+    def spawn(self, key, start):
+        """ Start a process for the key unless too many are running, and
+        return its SupervisedProcess.
+
+        'start' is called as start(limits) and must return a Popen object;
+        'limits' is a dict to pass to 'apply_limits' in the new process. The
+        output of the process is captured if it has a stdout pipe. If
+        'max_per_key' processes are running for the key already, the first of
+        them is returned instead.
+        """
+        with self._lock:
+            running = [p for p in self.processes if p.key == key]
+            if len(running) >= self.max_per_key:
+                running[0].focus_requested = True
+                return running[0]
+
+            if len(self.processes) >= self.max_processes:
+                raise TooManyProcessesException(key)
+
+            started = time.time()
+            process = start(self.limits())
+            supervised = SupervisedProcess(
+                key=key, process=process, pid=process.pid,
+                spawn_latency=time.time() - started
+            )
+            if process.stdout is not None:
+                supervised.output = OutputBuffer()
+                self.pump.add(process.stdout, supervised.output)
+
+            self.processes.append(supervised)
+            self.running_count = len(self.processes)
+            self._start_monitor()
+
+        return supervised
+
+    def popen(self, key, cmd, cwd=None):
+        """ Start the command for the key with the supervisor's limits. """
+        def start(limits):
+            preexec_fn = None
+            if resource is not None:
+                preexec_fn = lambda: apply_limits(limits)
+
+            return Popen(cmd, cwd=cwd, preexec_fn=preexec_fn, **output_pipes())
+
+        return self.spawn(key, start)
+
+    def limits(self):
+        """ Return the resource limits for new processes. """
+        return {'cpu': self.cpu_limit, 'memory': self.memory_limit}
+
+    #### Private protocol #####################################################
+
+    _lock = Any
+
+    _monitor = Any
+
+    def _start_monitor(self):
+        if self._monitor is not None and self._monitor.is_alive():
+            return
+
+        self._monitor = threading.Thread(target=self._run_monitor)
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def _run_monitor(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                exited = [p for p in self.processes if p.process.poll() is not None]
+                for supervised in exited:
+                    supervised.exit_code = supervised.process.returncode
+                    supervised.running = False
+                    self.processes.remove(supervised)
+
+                self.running_count = len(self.processes)
+                if not self.processes:
+                    self._monitor = None
+                    return
+
+
+def output_pipes():
+    """ Return the Popen keyword arguments which capture the output of a
+    process, if that is supported.
+    """
+    if CAPTURE_OUTPUT:
+        return {'stdout': PIPE, 'stderr': STDOUT}
+
+    return {}
+
+
+def apply_limits(limits):
+    """ Apply resource limits (as returned by ProcessSupervisor.limits) to the
+    current process.
+    """
+    if resource is None or not limits:
+        return
+
+    if limits.get('cpu'):
+        resource.setrlimit(resource.RLIMIT_CPU, (limits['cpu'], limits['cpu']))
+
+    if limits.get('memory'):
+        resource.setrlimit(
+            resource.RLIMIT_AS, (limits['memory'], limits['memory'])
+        )
@@ -0,0 +1,220 @@
+""" Static extraction of the templates of jigna examples.
+
+Instead of importing an example (which may import Qt, Mayavi and so on) to get
+at its template, the example's source is parsed and the arguments of its
+'Template(...)' construction are evaluated statically. Only string literals,
+module level names bound to them, '+' and 'join(...)' are understood, which
+covers the way the examples build their templates.
+
+Extracted templates are kept in an on-disk cache which is validated against
+the modification times and sizes of the files they were extracted from.
+"""
+
+import ast
+import json
+import os
+from os.path import dirname, exists, join
+
+from bs4 import BeautifulSoup
+
+#: The Template keyword arguments holding the HTML.
+BODY_HTML = 'body_html'
+HTML_FILE = 'html_file'
+
+
+def extract_html_code(filename, root):
+    """ Return (html_code, dependencies) for the example in 'filename'.
+
+    'html_code' is the prettified body of the example's template, or '' if no
+    template could be found. 'dependencies' are the paths of the files it was
+    extracted from. Relative HTML files are resolved against 'root'.
+    """
+    with open(filename, 'r') as f:
+        module = ast.parse(f.read(), filename)
+
+    names = _string_assignments(module)
+    dependencies = [filename]
+    for node in ast.walk(module):
+        if not _is_template_call(node):
+            continue
+
+        keywords = dict((keyword.arg, keyword.value) for keyword in node.keywords)
+        if BODY_HTML in keywords:
+            body_html = _string_value(keywords[BODY_HTML], names)
+            if body_html is not None:
+                html = '<html><body>%s</body></html>' % body_html
+                return _prettify(html), dependencies
+
+        if HTML_FILE in keywords:
+            html_file = _string_value(keywords[HTML_FILE], names)
+            if html_file is not None:
+                html_file = join(root, html_file)
+                with open(html_file, 'r') as f:
+                    html = f.read()
+
+                return _prettify(html), dependencies + [html_file]
+
+    return '', dependencies
+
+
+class TemplateCache(object):
+    """ An on-disk cache of extracted html code. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = {}
+
+    def load(self):
+        """ Load the cache from disk, if it has been saved before. """
+        if exists(self.filename):
+            with open(self.filename, 'r') as f:
+                self._entries = json.load(f)
+
+    def save(self):
+        """ Atomically save the cache to disk. """
+        directory = dirname(self.filename)
+        if directory and not exists(directory):
+            os.makedirs(directory)
+
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self._entries, f)
+
+        if os.name == 'nt' and exists(self.filename):
+            os.remove(self.filename)
+
+        os.rename(tmp_filename, self.filename)
+
+    def get(self, filename):
+        """ Return the cached html code for the example in 'filename', or None
+        if it is not cached or any of its dependencies has changed.
+        """
+        entry = self._entries.get(filename)
+        if entry is None:
+            return None
+
+        for path, key in entry['dependencies']:
+            if not exists(path) or list(_file_key(path)) != key:
+                return None
+
+        return entry['html_code']
+
+    def put(self, filename, html_code, dependencies):
+        """ Cache the html code extracted from the example in 'filename'. """
+        self._entries[filename] = {
+            'html_code': html_code,
+            'dependencies': [
+                [path, list(_file_key(path))] for path in dependencies
+            ]
+        }
+
+
+def precompute_html_code(cache, examples, processes=None):
+    """ Extract the html code of all (filename, root) examples missing from
+    the cache, in parallel, and save the cache.
+    """
+    missing = [
+        (filename, root) for filename, root in examples
+        if cache.get(filename) is None
+    ]
+    if not missing:
+        return
+
+    if len(missing) > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes)
+        try:
+            results = pool.map(_extract_html_code_star, missing)
+
+        finally:
+            pool.close()
+            pool.join()
+
+    else:
+        results = [_extract_html_code_star(missing[0])]
+
+    for (filename, root), (html_code, dependencies) in zip(missing, results):
+        cache.put(filename, html_code, dependencies)
+
+    cache.save()
+
+
+#### Private protocol #########################################################
+
+def _extract_html_code_star(args):
+    """ extract_html_code taking a tuple, for use with Pool.map. """
+    filename, root = args
+    return extract_html_code(filename, root)
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def _prettify(html):
+    return BeautifulSoup(html).body.prettify()
+
+
+def _is_template_call(node):
+    if not isinstance(node, ast.Call):
+        return False
+
+    func = node.func
+    if isinstance(func, ast.Name):
+        return func.id == 'Template'
+
+    if isinstance(func, ast.Attribute):
+        return func.attr == 'Template'
+
+    return False
+
+
+def _string_assignments(module):
+    """ Return the module level names bound to statically known strings. """
+    names = {}
+    for node in module.body:
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1:
+            continue
+
+        target = node.targets[0]
+        if isinstance(target, ast.Name):
+            value = _string_value(node.value, names)
+            if value is not None:
+                names[target.id] = value
+
+    return names
+
+
+def _string_value(node, names):
+    """ Return the value of the string expression 'node', or None if it is
+    not known statically.
+    """
+    if isinstance(node, ast.Str):
+        return node.s
+
+    if isinstance(node, ast.Name):
+        return names.get(node.id)
+
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = _string_value(node.left, names)
+        right = _string_value(node.right, names)
+        if left is not None and right is not None:
+            return left + right
+
+    if isinstance(node, ast.Call) and _is_join(node.func) and not node.keywords:
+        parts = [_string_value(arg, names) for arg in node.args]
+        if parts and None not in parts:
+            return join(*parts)
+
+    return None
+
+
+def _is_join(func):
+    if isinstance(func, ast.Name):
+        return func.id == 'join'
+
+    if isinstance(func, ast.Attribute):
+        return func.attr == 'join'
+
+    return False
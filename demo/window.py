@@ -0,0 +1,135 @@
+""" Windowed views onto large list traits.
+
+A ListWindow exposes a slice ('offset' and 'limit') of a list trait of another
+object as its own 'items' list, plus the length of the whole list as 'total'.
+Views repeat over the window's items instead of over the list, so only the
+visible objects are proxied to them. Changes to the list outside the window
+only update the total, replacements inside it are forwarded item by item and
+anything else re-slices the window, so keeping a window up to date costs the
+same however long the list is.
+"""
+
+from traits.api import HasTraits, Any, Bool, Instance, Int, List, Property, Str
+
+
+class ListWindow(HasTraits):
+    """ A window onto a slice of a list trait. """
+
+    #: The object with the list trait.
+    source = Instance(HasTraits)
+
+    #: The name of the list trait.
+    name = Str
+
+    #: Index of the first item in the window.
+    offset = Int(0)
+
+    #: Maximum number of items in the window.
+    limit = Int(50)
+
+    #: A callable which returns the item to show for an item of the list, eg.
+    #: to create view objects only for the items in the window.
+    adapter = Any
+
+    #: The items in the window.
+    items = List
+
+    #: The length of the whole list.
+    total = Int
+
+    has_previous = Property(Bool, depends_on='offset')
+    def _get_has_previous(self):
+        return self.offset > 0
+
+    has_next = Property(Bool, depends_on='offset, limit, total')
+    def _get_has_next(self):
+        return self.offset + self.limit < self.total
+
+    def __init__(self, **traits):
+        super(ListWindow, self).__init__(**traits)
+        self._bind(self.source, self.name)
+        self._reslice()
+
+    def scroll(self, delta):
+        """ Move the window by 'delta' items. """
+        last = max(0, self.total - 1)
+        self.offset = max(0, min(self.offset + delta, last))
+
+    def next_page(self):
+        if self.has_next:
+            self.scroll(self.limit)
+
+    def previous_page(self):
+        self.scroll(-self.limit)
+
+    #### Private protocol #####################################################
+
+    def _source_changed(self, old, new):
+        if self.traits_inited():
+            self._bind(old, self.name, remove=True)
+            self._bind(new, self.name)
+            self._reslice()
+
+    def _name_changed(self, old, new):
+        if self.traits_inited():
+            self._bind(self.source, old, remove=True)
+            self._bind(self.source, new)
+            self._reslice()
+
+    def _offset_changed(self):
+        self._reslice()
+
+    def _limit_changed(self):
+        self._reslice()
+
+    def _bind(self, source, name, remove=False):
+        if source is None or not name:
+            return
+
+        source.on_trait_change(self._reslice, name, remove=remove)
+        source.on_trait_change(
+            self._list_items_changed, name + '_items', remove=remove
+        )
+
+    def _list(self):
+        if self.source is None or not self.name:
+            return []
+
+        return getattr(self.source, self.name)
+
+    def _reslice(self):
+        items = self._list()
+        self.total = len(items)
+        if self.offset and self.offset >= self.total:
+            # The list shrank below the window, show its last page instead.
+            self.offset = max(0, self.total - 1) // self.limit * self.limit
+            return
+
+        window = self._adapt(items[self.offset:self.offset + self.limit])
+        if window != self.items:
+            self.items = window
+
+    def _list_items_changed(self, event):
+        self.total = len(self._list())
+
+        index = event.index
+        if isinstance(index, slice) or len(event.added) != len(event.removed):
+            # The items after the change moved, so they may have moved into
+            # or out of the window.
+            if isinstance(index, slice) or index < self.offset + self.limit:
+                self._reslice()
+
+            return
+
+        # Items were replaced, forward the ones inside the window.
+        start = max(index, self.offset)
+        end = min(index + len(event.added), self.offset + self.limit)
+        if start < end:
+            self.items[start - self.offset:end - self.offset] = \
+                self._adapt(event.added[start - index:end - index])
+
+    def _adapt(self, items):
+        if self.adapter is None:
+            return list(items)
+
+        return [self.adapter(item) for item in items]